@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: bench_fetch.py
+@Time: 2025/01/20 17:05
+@Function: Compare full, symmetric (upper triangle) and parallel tile fetching
+"""
+import argparse
+import time
+from functools import partial
+
+import numpy as np
+
+from fixtures import MockMatrixZoomData
+from plothic.ParseHiC import assemble_matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark .hic tile fetching')
+    parser.add_argument('--bins', type=int, nargs='+', default=[2000, 5000, 10000], help='Matrix sizes in bins')
+    parser.add_argument('--tile-size', type=int, default=1400, help='Number of bins per tile, default: 1400')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per fetch call, default: 0.05')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Worker processes for the parallel run, default: 4')
+    args = parser.parse_args()
+
+    resolution = 10000
+    print("bins\ttiles\tfetch_full\tfetch_sym\ttime_full\ttime_sym\tspeedup\ttime_parallel")
+    for n_bins in args.bins:
+        end = n_bins * resolution
+        result = {}
+        for symmetric in (False, True):
+            matrix_obj = MockMatrixZoomData(n_bins, resolution, latency=args.latency)
+            start_time = time.perf_counter()
+            matrix = assemble_matrix(matrix_obj, 0, end, resolution, tile_size=args.tile_size, symmetric=symmetric)
+            result[symmetric] = (matrix_obj.calls, time.perf_counter() - start_time, matrix)
+
+        opener = partial(MockMatrixZoomData, n_bins, resolution, latency=args.latency)
+        start_time = time.perf_counter()
+        matrix = assemble_matrix(opener(), 0, end, resolution, tile_size=args.tile_size, threads=args.threads,
+                                 opener=opener)
+        parallel_time = time.perf_counter() - start_time
+
+        assert np.array_equal(result[False][2], result[True][2])
+        assert np.array_equal(result[True][2], matrix)
+        n_tiles = -(-n_bins // args.tile_size)
+        print(f"{n_bins}\t{n_tiles}x{n_tiles}\t{result[False][0]}\t{result[True][0]}\t"
+              f"{result[False][1]:.2f}\t{result[True][1]:.2f}\t{result[False][1] / result[True][1]:.2f}x\t"
+              f"{parallel_time:.2f}")
+
+
+if __name__ == '__main__':
+    main()
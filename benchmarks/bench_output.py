@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: bench_output.py
+@Time: 2025/04/02 15:18
+@Function: Time and file size of the raster output engine against imshow and savefig, per output format
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+matplotlib.use("Agg")
+import numpy as np  # noqa: E402
+
+from fixtures import peak_rss_mb, synthetic_contacts  # noqa: E402
+from plothic.PlotMTX import plot_matrix  # noqa: E402
+from plothic.cli import __version__  # noqa: E402
+from plothic.logger import logger  # noqa: E402
+
+ENGINES = ("matplotlib", "raster")
+
+
+def run_case(engine, out_format, n_pixels, work_dir, fig_size, dpi, vector_dpi):
+    # one engine and format on a binned matrix of n_pixels, in a fresh process so the peak RSS is its own
+    logger.setLevel("WARNING")
+    index = np.arange(n_pixels)
+    matrix = synthetic_contacts(index[:, None], index[None, :])
+    chr_info = {f"chr{k + 1}": (k + 1) * n_pixels / 8 for k in range(8)}
+    outfile = os.path.join(work_dir, f"{engine}_{n_pixels}.{out_format}")
+
+    start_time = time.perf_counter()
+    plot_matrix(matrix, chr_info=chr_info, outfile=outfile, fig_size=(fig_size, fig_size), dpi=dpi, bar_max=100,
+                engine=engine, vector_dpi=vector_dpi)
+    seconds = time.perf_counter() - start_time
+    return {"engine": engine, "format": out_format, "pixels": n_pixels, "seconds": round(seconds, 4),
+            "size_mb": round(os.path.getsize(outfile) / 1024 ** 2, 3), "peak_rss_mb": peak_rss_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the output engines of plot_matrix')
+    parser.add_argument('--formats', type=str, nargs='+', default=['png', 'tiff', 'pdf', 'svg'],
+                        help='Output formats, default: png tiff pdf svg')
+    parser.add_argument('--pixels', type=int, nargs='+', default=[1000, 3000],
+                        help='Sizes of the binned matrix, default: 1000 3000 (fig size 10 at 300 dpi)')
+    parser.add_argument('-f', '--fig-size', type=int, default=10, help='Figure size, default: 10')
+    parser.add_argument('-dpi', type=int, default=300, help='DPI for the output figure, default: 300')
+    parser.add_argument('--vector-dpi', type=int, default=150,
+                        help='DPI of the heatmap image in vector figures (raster engine), default: 150')
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='Directory for the figures, default: a temporary one')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.work_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="plothic_bench_")
+        args.work_dir = temp_dir.name
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    result = {"plothic": __version__, "python": platform.python_version(), "matplotlib": matplotlib.__version__,
+              "platform": platform.platform(), "fig_size": args.fig_size, "dpi": args.dpi,
+              "vector_dpi": args.vector_dpi, "cases": []}
+    context = multiprocessing.get_context("spawn")
+    print("format\tpixels\tengine\tseconds\tsize_mb\tpeak_rss_mb\tspeedup\tsize_ratio")
+    for out_format in args.formats:
+        for n_pixels in args.pixels:
+            cases = {}
+            for engine in ENGINES:
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    cases[engine] = executor.submit(run_case, engine, out_format, n_pixels, args.work_dir,
+                                                    args.fig_size, args.dpi, args.vector_dpi).result()
+                result["cases"].append(cases[engine])
+
+            # ratios of the raster engine to the imshow and savefig path
+            base = cases["matplotlib"]
+            for engine, case in cases.items():
+                speedup = base["seconds"] / case["seconds"] if case["seconds"] > 0 else float("inf")
+                size_ratio = case["size_mb"] / base["size_mb"] if base["size_mb"] > 0 else float("inf")
+                print(f"{out_format}\t{n_pixels}\t{engine}\t{case['seconds']:.3f}\t{case['size_mb']:.2f}\t"
+                      f"{case['peak_rss_mb']}\t{speedup:.2f}x\t{size_ratio:.2f}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
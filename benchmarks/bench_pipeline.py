@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: bench_pipeline.py
+@Time: 2025/03/20 09:42
+@Function: Time and peak memory of every plotting stage on synthetic HiCPro and .hic-like inputs
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.figure  # noqa: E402
+import numpy as np  # noqa: E402
+
+from fixtures import MockMatrixZoomData, peak_rss_mb, write_hicpro  # noqa: E402
+from plothic import PlotMTX  # noqa: E402
+from plothic.BinMTX import bin_matrix  # noqa: E402
+from plothic.ColorScale import approx_percentile  # noqa: E402
+from plothic.ParseBed import load_hicpro  # noqa: E402
+from plothic.ParseHiC import assemble_matrix  # noqa: E402
+from plothic.Reorder import BlockReorder, reorder_matrix  # noqa: E402
+from plothic.cli import __version__  # noqa: E402
+from plothic.logger import logger  # noqa: E402
+
+RESOLUTION = 10000
+N_CHROMS = 8
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, func, *args, **kwargs):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stages[name] = {"seconds": round(time.perf_counter() - start_time, 4), "peak_rss_mb": peak_rss_mb()}
+        return result
+
+
+def _render_and_save(timer, matrix, chr_info, bar_max, outfile, fig_size, dpi):
+    # plot_matrix on the binned matrix, the time spent in savefig (vector formats) or in writing the pixel buffer
+    # (raster formats) is reported as the save stage
+    save_time = []
+    savefig = matplotlib.figure.Figure.savefig
+    save_canvas = PlotMTX.save_canvas
+
+    def timed(func):
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            result = func(*args, **kwargs)
+            save_time.append(time.perf_counter() - start_time)
+            return result
+        return wrapper
+
+    matplotlib.figure.Figure.savefig = timed(savefig)
+    PlotMTX.save_canvas = timed(save_canvas)
+    try:
+        timer.run("render", PlotMTX.plot_matrix, matrix, chr_info=chr_info, outfile=outfile,
+                  fig_size=(fig_size, fig_size), dpi=dpi, bar_max=bar_max)
+    finally:
+        matplotlib.figure.Figure.savefig = savefig
+        PlotMTX.save_canvas = save_canvas
+    timer.stages["render"]["seconds"] = round(timer.stages["render"]["seconds"] - sum(save_time), 4)
+    timer.stages["save"] = {"seconds": round(sum(save_time), 4), "peak_rss_mb": peak_rss_mb()}
+
+
+def run_case(pipeline, n_bins, work_dir, fig_size, dpi, out_format, band):
+    # one pipeline at one size, run in a fresh process so the peak RSS belongs to this case only
+    logger.setLevel("WARNING")
+    timer = StageTimer()
+    chrom_edges = np.linspace(0, n_bins, N_CHROMS + 1).astype(int)
+    bounds = list(zip(chrom_edges[:-1].tolist(), chrom_edges[1:].tolist()))
+    order = list(range(N_CHROMS))[::-1]  # reverse the chromosomes
+
+    if pipeline == "hicpro":
+        matrix_file, bed_file = write_hicpro(os.path.join(work_dir, f"bins_{n_bins}"), n_bins, n_chroms=N_CHROMS,
+                                             resolution=RESOLUTION, band=band)
+        matrix, chr_info = timer.run("load", load_hicpro, matrix_file, bed_file)
+        matrix = timer.run("reorder", reorder_matrix, matrix, bounds, order)
+    else:
+        matrix_obj = MockMatrixZoomData(n_bins, RESOLUTION)
+        matrix = timer.run("assemble", assemble_matrix, matrix_obj, 0, n_bins * RESOLUTION, RESOLUTION)
+        matrix = timer.run("reorder", BlockReorder, matrix, bounds, order)  # lazy, the copies happen when binned
+
+    binned, factor = timer.run("bin", bin_matrix, matrix, int(fig_size * dpi))
+    bar_max = timer.run("color_scale", approx_percentile, binned, 90)
+    chr_info = {f"chr{k + 1}": (chrom_edges[k + 1] - chrom_edges[k]) / factor for k in order}
+    _render_and_save(timer, binned, chr_info, bar_max, os.path.join(work_dir, f"{pipeline}_{n_bins}.{out_format}"),
+                     fig_size, dpi)
+
+    return {"pipeline": pipeline, "bins": n_bins, "stages": timer.stages,
+            "total_seconds": round(sum(stage["seconds"] for stage in timer.stages.values()), 4),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def compare(result, baseline_file):
+    # ratio of every stage time to the same stage of a previous result file
+    with open(baseline_file, 'r') as f:
+        baseline = {(case["pipeline"], case["bins"]): case for case in json.load(f)["cases"]}
+    print("pipeline\tbins\tstage\tbaseline_s\tcurrent_s\tratio")
+    for case in result["cases"]:
+        old = baseline.get((case["pipeline"], case["bins"]))
+        if old is None or "stages" not in case or "stages" not in old:
+            continue
+        for name, stage in case["stages"].items():
+            if name in old["stages"]:
+                old_seconds = old["stages"][name]["seconds"]
+                ratio = stage["seconds"] / old_seconds if old_seconds > 0 else float("inf")
+                print(f"{case['pipeline']}\t{case['bins']}\t{name}\t{old_seconds:.3f}\t{stage['seconds']:.3f}\t"
+                      f"{ratio:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the plotting stages on synthetic data')
+    parser.add_argument('--bins', type=int, nargs='+', default=[1000, 10000, 50000, 200000],
+                        help='Matrix sizes in bins')
+    parser.add_argument('--pipelines', type=str, nargs='+', default=['hicpro', 'hic'], choices=['hicpro', 'hic'],
+                        help='Input formats to benchmark, default: hicpro hic')
+    parser.add_argument('--max-dense-bins', type=int, default=20000,
+                        help='Skip the .hic pipeline (dense matrix) above this size, default: 20000')
+    parser.add_argument('--band', type=int, default=10,
+                        help='Number of diagonals in the synthetic HiCPro matrix, default: 10')
+    parser.add_argument('-f', '--fig-size', type=int, default=10, help='Figure size, default: 10')
+    parser.add_argument('-dpi', type=int, default=300, help='DPI for the output figure, default: 300')
+    parser.add_argument('-format', type=str, default="png", help='Output format for the figure, default: png')
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='Directory for the fixtures and figures, fixtures are reused, default: a temporary one')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare the stage times to this result file')
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.work_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="plothic_bench_")
+        args.work_dir = temp_dir.name
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    result = {"plothic": __version__, "python": platform.python_version(), "numpy": np.__version__,
+              "platform": platform.platform(), "fig_size": args.fig_size, "dpi": args.dpi, "cases": []}
+    context = multiprocessing.get_context("spawn")
+    for n_bins in args.bins:
+        for pipeline in args.pipelines:
+            if pipeline == "hic" and n_bins > args.max_dense_bins:
+                result["cases"].append({"pipeline": pipeline, "bins": n_bins, "skipped": "above --max-dense-bins"})
+                continue
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                case = executor.submit(run_case, pipeline, n_bins, args.work_dir, args.fig_size, args.dpi,
+                                       args.format, args.band).result()
+            result["cases"].append(case)
+            stages = " ".join(f"{name}={stage['seconds']:.3f}s" for name, stage in case["stages"].items())
+            print(f"{pipeline}\t{n_bins}\t{stages}\ttotal={case['total_seconds']:.3f}s\t"
+                  f"peak_rss={case['peak_rss_mb']} MB", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        compare(result, args.baseline)
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
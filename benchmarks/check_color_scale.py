@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: check_color_scale.py
+@Time: 2025/04/18 10:05
+@Function: Check the streamed percentile of the color range against NumPy, with NaN rows and sparse input
+"""
+import argparse
+import sys
+
+import numpy as np
+from scipy import sparse
+
+from fixtures import synthetic_contacts
+from plothic.ColorScale import approx_percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check approx_percentile of the default color range')
+    parser.add_argument('--bins', type=int, default=2000, help='Size of the synthetic matrix, default: 2000')
+    parser.add_argument('-q', type=float, nargs='+', default=[50, 90, 95, 99], help='Percentiles, default: 50 90 95 99')
+    args = parser.parse_args()
+    failed = False
+
+    index = np.arange(args.bins)
+    matrix = synthetic_contacts(index[:, None], index[None, :]).astype(np.float32)
+    # masked rows and columns of a balanced matrix are NaN, they must not change the percentile of the other values
+    masked = np.arange(0, args.bins, 97)
+    with_nan = matrix.copy()
+    with_nan[masked, :] = np.nan
+    with_nan[:, masked] = np.nan
+    finite = with_nan[np.isfinite(with_nan)]
+    tolerance = float(finite.max() - finite.min()) / 4096 ** 2 * 4
+
+    for q in args.q:
+        cases = {
+            "dense": (approx_percentile(matrix, q), np.percentile(matrix, q)),
+            "nan rows": (approx_percentile(with_nan, q), np.nanpercentile(with_nan, q)),
+            "nan rows = finite values": (approx_percentile(with_nan, q), approx_percentile(finite, q)),
+            "sparse": (approx_percentile(sparse.csr_matrix(matrix), q), np.percentile(matrix, q)),
+        }
+        for name, (value, expected) in cases.items():
+            ok = abs(value - expected) <= tolerance
+            failed |= not ok
+            print(f"{'ok' if ok else 'FAIL'}\tq{q:g}\t{name}\t{value:.6g}\t{expected:.6g}")
+
+    all_nan = np.full((10, 10), np.nan, dtype=np.float32)
+    value = approx_percentile(all_nan, 95)
+    print(f"{'ok' if value == 0 else 'FAIL'}\tq95\tall NaN\t{value:.6g}\t0")
+    failed |= value != 0
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
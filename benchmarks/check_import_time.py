@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: check_import_time.py
+@Time: 2025/03/26 10:20
+@Function: Check that the CLI starts without the plotting stack and within the import time budget
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+HEAVY_MODULES = ("numpy", "scipy", "matplotlib", "mpl_toolkits", "hicstraw")
+
+
+def python(*args):
+    # run the interpreter on the source tree
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_DIR, os.environ.get("PYTHONPATH", "")]))
+    return subprocess.run([sys.executable, *args], env=env, capture_output=True, text=True)
+
+
+def import_times(module):
+    # (cumulative microseconds, module) of every import, from python -X importtime
+    result = python("-X", "importtime", "-c", f"import {module}")
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the plothic CLI')
+    parser.add_argument('--max-import-ms', type=float, default=100,
+                        help='Budget for importing plothic.cli, default: 100 ms')
+    parser.add_argument('--repeat', type=int, default=5, help='Take the best of this many runs, default: 5')
+    parser.add_argument('--top', type=int, default=10, help='Show the slowest imports, default: 10')
+    args = parser.parse_args()
+    failed = False
+
+    # modules loaded by the CLI before any plotting
+    loaded = python("-c", "import sys, plothic.cli; print(' '.join(sys.modules))").stdout.split()
+    heavy = [module for module in HEAVY_MODULES if module in loaded]
+    if heavy:
+        print(f"FAIL: importing plothic.cli loads {', '.join(heavy)}")
+        failed = True
+
+    runs = [import_times("plothic.cli") for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: dict((name, us) for us, name in times).get("plothic.cli", 0))
+    cli_ms = dict((name, us) for us, name in best).get("plothic.cli", 0) / 1000
+    print(f"import plothic.cli: {cli_ms:.1f} ms (budget {args.max_import_ms:.0f} ms)")
+    for us, name in sorted(best, reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    if cli_ms > args.max_import_ms:
+        print("FAIL: import time over budget")
+        failed = True
+
+    # whole process, as paid by every batch job
+    wall = []
+    for _ in range(args.repeat):
+        start_time = time.perf_counter()
+        python("-m", "plothic.cli", "-v")
+        wall.append(time.perf_counter() - start_time)
+    print(f"plothic -v: {min(wall) * 1000:.1f} ms")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: fixtures.py
+@Time: 2025/01/20 16:40
+@Function: Synthetic Hi-C data for the benchmarks
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+# run the benchmarks against the source tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+def peak_rss_mb():
+    # peak resident memory of this process so far, None where the resource module is missing (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024, 1)  # bytes on macOS, KB on Linux
+
+
+def synthetic_contacts(row, col):
+    # symmetric distance-decay counts with some deterministic noise
+    lo = np.minimum(row, col)
+    hi = np.maximum(row, col)
+    noise = 1 + (lo * 7919 + hi * 104729) % 13
+    return (1000.0 / (1 + hi - lo) * noise).astype(np.float32)
+
+
+class MockMatrixZoomData:
+    # stand-in for hicstraw.MatrixZoomData of the 'assembly' pseudo-chromosome
+
+    def __init__(self, n_bins, resolution, latency=0.0):
+        self.n_bins = n_bins
+        self.resolution = resolution
+        self.latency = latency  # seconds per call, to mimic block decompression
+        self.calls = 0
+
+    def getRecordsAsMatrix(self, x0, x1, y0, y1):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        rows = np.arange(x0 // self.resolution, x1 // self.resolution + 1)
+        cols = np.arange(y0 // self.resolution, y1 // self.resolution + 1)
+        tile = synthetic_contacts(rows[:, None], cols[None, :])
+        tile[rows >= self.n_bins, :] = 0
+        tile[:, cols >= self.n_bins] = 0
+        return tile
+
+
+def write_hicpro(prefix, n_bins, n_chroms=8, resolution=10000, band=10):
+    # HiCPro prefix.matrix (upper triangle, 1-based bins, the first band diagonals) and prefix_abs.bed
+    matrix_file, bed_file = f"{prefix}.matrix", f"{prefix}_abs.bed"
+    if os.path.exists(matrix_file) and os.path.exists(bed_file):
+        return matrix_file, bed_file
+
+    chrom_bins = np.diff(np.linspace(0, n_bins, n_chroms + 1).astype(int))
+    with open(bed_file, 'w') as f:
+        bin_id = 1
+        for k, chrom_len in enumerate(chrom_bins):
+            for i in range(chrom_len):
+                f.write(f"chr{k + 1}\t{i * resolution}\t{(i + 1) * resolution}\t{bin_id}\n")
+                bin_id += 1
+
+    with open(matrix_file, 'w') as f:
+        for offset in range(min(band, n_bins)):
+            row = np.arange(n_bins - offset)
+            col = row + offset
+            count = np.maximum(1, np.rint(synthetic_contacts(row, col))).astype(np.int64)
+            np.savetxt(f, np.column_stack((row + 1, col + 1, count)), fmt="%d", delimiter="\t")
+    return matrix_file, bed_file
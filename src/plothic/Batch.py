@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Batch.py
+@Time: 2025/02/10 09:36
+@Function: Plot many Hi-C inputs from a manifest file with a worker pool
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .logger import logger
+
+# manifest columns holding input files, outputs older than any of them are re-plotted
+INPUT_COLUMNS = ("hic_file", "chr_txt", "assembly", "hic_split", "matrix", "abs_bed", "abs_order")
+
+
+def read_manifest(manifest):
+    # tab separated, the header row holds the plothic option names (e.g. hic-file, chr-txt, resolution, output)
+    # job names identify the jobs and their summary rows, an empty or repeated name is an error
+    jobs = []
+    header = None
+    names = set()
+    with open(manifest, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if line.startswith("#") or line.strip() == "":
+                continue
+            fields = [field.strip() for field in line.rstrip("\r\n").split("\t")]
+            if header is None:
+                header = [field.lstrip("-") for field in fields]
+                continue
+            job = dict(zip(header, fields))
+            job.setdefault("name", f"job{len(jobs) + 1}")
+            if job["name"] == "":
+                raise ValueError(f"Empty job name at line {line_number} of {manifest}")
+            if job["name"] in names:
+                raise ValueError(f"Duplicate job name {job['name']} at line {line_number} of {manifest}")
+            names.add(job["name"])
+            jobs.append(job)
+
+    return jobs
+
+
+def job_argv(parser, job):
+    # translate one manifest row into plothic command line arguments
+    argv = []
+    for column, value in job.items():
+        if column == "name" or value in ("", "NA", "."):
+            continue
+        option = f"--{column}" if f"--{column}" in parser._option_string_actions else f"-{column}"
+        action = parser._option_string_actions.get(option)
+        if action is None:
+            raise ValueError(f"Unknown manifest column: {column}")
+        if action.nargs == 0:  # flags, set by true/yes/1
+            if value.lower() in ("1", "true", "yes"):
+                argv.append(option)
+        else:
+            argv.extend([option, value])
+
+    return argv
+
+
+def expected_outputs(args):
+    # mirror the output naming of plot_hic / plot_hic_split / plot_bed / plot_bed_split
+    bed_input = args.matrix and (args.abs_bed or os.path.isdir(args.matrix))  # text files or a store directory
+    if bed_input and args.bed_split and os.path.isdir(args.matrix):
+        with open(os.path.join(args.matrix, "chroms.json"), 'r') as f:
+            names = list(json.load(f)["chromosomes"])
+    elif bed_input and args.bed_split:
+        with (gzip.open(args.abs_bed, 'rt') if args.abs_bed.endswith(".gz") else open(args.abs_bed, 'r')) as f:
+            names = dict.fromkeys(line.split()[0] for line in f if line.strip() and not line.startswith("#"))
+    elif args.hic_file and args.hic_split != "" and not bed_input:
+        with open(args.hic_split, 'r') as f:
+            names = [line.split()[0] for line in f if line.strip() and not line.startswith("#")]
+    else:
+        if os.path.isdir(args.output):
+            return [os.path.join(args.output, f"GenomeContact.{args.format}")]
+        return [args.output]
+
+    out_dir = args.output if os.path.isdir(args.output) else "./"
+    return [os.path.join(out_dir, f"{name}.{args.format}") for name in names]
+
+
+def is_up_to_date(args):
+    outputs = expected_outputs(args)
+    if not all(os.path.exists(output) for output in outputs):
+        return False
+    inputs = [getattr(args, column) for column in INPUT_COLUMNS if getattr(args, column)]
+    if not inputs:
+        return False
+    newest_input = max(os.path.getmtime(file) for file in inputs)
+    return min(os.path.getmtime(output) for output in outputs) >= newest_input
+
+
+def _limit_memory(max_memory):
+    # cap the address space of every worker process (POSIX only)
+    if max_memory:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def run_job(name, argv):
+    from .cli import build_parser, run
+
+    start_time = time.perf_counter()
+    try:
+        run(build_parser().parse_args(argv))
+        status, message = "done", ""
+    except BaseException as e:  # SystemExit and MemoryError included, keep the rest of the batch going
+        status, message = "failed", f"{type(e).__name__}: {e}"
+    return {"name": name, "status": status, "seconds": round(time.perf_counter() - start_time, 2),
+            "message": message}
+
+
+def batch_main(argv=None):
+    from .cli import build_parser
+
+    parser = argparse.ArgumentParser(prog="plothic batch",
+                                     description='Plot many Hi-C inputs listed in a manifest file')
+    parser.add_argument('manifest', type=str,
+                        help='Tab separated manifest, the header row holds plothic option names '
+                             '(e.g. hic-file, chr-txt, resolution, output) and an optional name column')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of jobs to run at once, default: 1')
+    parser.add_argument('--max-memory', type=float, default=None, help='Maximum memory of each job in GB')
+    parser.add_argument('--summary', type=str, default=None,
+                        help='Per-job summary file, default: <manifest>.summary.tsv')
+    parser.add_argument('--force', action='store_true', help='Re-plot jobs whose outputs are up to date')
+    args = parser.parse_args(argv)
+
+    plot_parser = build_parser()
+    try:
+        jobs = read_manifest(args.manifest)
+    except ValueError as e:
+        logger.error(e)
+        exit(1)
+    logger.info(f"Read {len(jobs)} jobs from manifest: {args.manifest}")
+
+    results = []
+    pending = {}
+    for job in jobs:
+        try:
+            job_args = job_argv(plot_parser, job)
+            if not args.force and is_up_to_date(plot_parser.parse_args(job_args)):
+                logger.info(f"Skip {job['name']}, the outputs are up to date")
+                results.append({"name": job["name"], "status": "skipped", "seconds": 0, "message": ""})
+                continue
+        except (ValueError, OSError) as e:
+            logger.error(f"Invalid job {job['name']}: {e}")
+            results.append({"name": job["name"], "status": "failed", "seconds": 0, "message": str(e)})
+            continue
+        pending[job["name"]] = job_args
+
+    max_memory = int(args.max_memory * 1024 ** 3) if args.max_memory else None
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs), initializer=_limit_memory,
+                             initargs=(max_memory,)) as executor:
+        futures = [executor.submit(run_job, name, job_args) for name, job_args in pending.items()]
+        for future in as_completed(futures):
+            result = future.result()
+            logger.info(f"Job {result['name']} {result['status']} in {result['seconds']} s {result['message']}")
+            results.append(result)
+
+    # keep the manifest order in the summary
+    order = {job["name"]: i for i, job in enumerate(jobs)}
+    results.sort(key=lambda result: order[result["name"]])
+    summary = args.summary if args.summary else f"{args.manifest}.summary.tsv"
+    with open(summary, 'w') as f:
+        f.write("name\tstatus\tseconds\tmessage\n")
+        for result in results:
+            f.write(f"{result['name']}\t{result['status']}\t{result['seconds']}\t{result['message']}\n")
+
+    failed = sum(result["status"] == "failed" for result in results)
+    logger.info(f"Finished batch: {len(results) - failed} succeeded or skipped, {failed} failed, summary: {summary}")
+    if failed:
+        exit(1)
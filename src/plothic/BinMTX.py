@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: BinMTX.py
+@Time: 2025/01/16 14:02
+@Function: Bin the contact matrix to the pixel grid of the figure
+"""
+import numpy as np
+from scipy import sparse
+
+REDUCERS = ("sum", "mean", "max")
+
+
+def bin_factor(n_bins, n_pixels):
+    # number of matrix bins merged into one pixel
+    return max(1, -(-n_bins // max(1, int(n_pixels))))
+
+
+class PixelGrid:
+    # accumulate dense blocks or sparse records of a square matrix into a (size, size) pixel grid
+
+    def __init__(self, n_bins, n_pixels, reducer="mean", factor=None):
+        # factor: bins per pixel, given to align the pixel grids of matrices of different sizes
+        if reducer not in REDUCERS:
+            raise ValueError(f"Unknown reducer: {reducer}, choose from {REDUCERS}")
+        self.n_bins = n_bins
+        self.reducer = reducer
+        self.factor = bin_factor(n_bins, n_pixels) if factor is None else factor
+        self.size = -(-n_bins // self.factor)
+        self.grid = np.zeros((self.size, self.size), dtype=np.float64)
+
+    def _segments(self, start, length):
+        # local offsets where a new pixel starts inside [start, start + length)
+        first = (-start) % self.factor
+        edges = np.arange(first, length, self.factor)
+        if first != 0:
+            edges = np.concatenate(([0], edges))
+        return edges
+
+    def add_block(self, block, row_start=0, col_start=0):
+        block = np.asarray(block)
+        if block.size == 0:
+            return
+        row_edges = self._segments(row_start, block.shape[0])
+        col_edges = self._segments(col_start, block.shape[1])
+
+        if self.reducer == "max":
+            reduced = np.maximum.reduceat(np.maximum.reduceat(block, row_edges, axis=0), col_edges, axis=1)
+        else:
+            reduced = np.add.reduceat(np.add.reduceat(block, row_edges, axis=0, dtype=np.float64), col_edges, axis=1)
+
+        row_pixel = (row_start + row_edges[0]) // self.factor
+        col_pixel = (col_start + col_edges[0]) // self.factor
+        target = self.grid[row_pixel:row_pixel + reduced.shape[0], col_pixel:col_pixel + reduced.shape[1]]
+        if self.reducer == "max":
+            np.maximum(target, reduced, out=target)
+        else:
+            target += reduced
+
+    def add_records(self, row, col, value, chunk_size=10000000):
+        for i in range(0, len(value), chunk_size):
+            row_pixel = row[i:i + chunk_size] // self.factor
+            col_pixel = col[i:i + chunk_size] // self.factor
+            if self.reducer == "max":
+                np.maximum.at(self.grid, (row_pixel, col_pixel), value[i:i + chunk_size])
+            else:
+                self.grid += np.bincount(row_pixel.astype(np.int64) * self.size + col_pixel,
+                                         weights=value[i:i + chunk_size],
+                                         minlength=self.size * self.size).reshape(self.size, self.size)
+
+    def result(self):
+        grid = self.grid.astype(np.float32)
+        if self.reducer == "mean":
+            # number of matrix bins covered by each pixel row / column (the last one may be partial)
+            edges = np.minimum(np.arange(self.size + 1) * self.factor, self.n_bins)
+            span = np.diff(edges).astype(np.float32)
+            grid /= span[:, None]
+            grid /= span[None, :]
+        return grid
+
+
+def bin_matrix(matrix, n_pixels, reducer="mean", chunk_pixels=64, factor=None):
+    n_bins = matrix.shape[0]
+    factor = bin_factor(n_bins, n_pixels) if factor is None else factor
+    if factor == 1:
+        return (matrix.toarray() if hasattr(matrix, "toarray") else matrix), 1
+
+    grid = PixelGrid(n_bins, n_pixels, reducer=reducer, factor=factor)
+    if sparse.issparse(matrix):
+        matrix = matrix.tocoo()
+        grid.add_records(matrix.row, matrix.col, matrix.data)
+    elif hasattr(matrix, "blocks"):
+        # block-fetched input, e.g. a lazily reordered matrix
+        for block, row_start, col_start in matrix.blocks():
+            grid.add_block(block, row_start, col_start)
+    else:
+        # reduce row chunks aligned to the pixel grid, so the temporary stays small
+        chunk = chunk_pixels * factor
+        for row_start in range(0, n_bins, chunk):
+            grid.add_block(matrix[row_start:row_start + chunk], row_start, 0)
+
+    return grid.result(), factor
+
+
+def scale_labels(label_dict, factor):
+    if label_dict is None or factor == 1:
+        return label_dict
+    return {label: loci / factor for label, loci in label_dict.items()}
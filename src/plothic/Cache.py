@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Cache.py
+@Time: 2025/01/22 11:18
+@Function: On-disk cache of extracted contact matrices
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy import sparse
+
+from .Profile import profiler
+from .logger import logger
+
+
+def save_matrix(directory, matrix):
+    # write a dense or sparse matrix as .npy files, return what load_matrix needs to open it
+    os.makedirs(directory, exist_ok=True)
+    if sparse.issparse(matrix):
+        matrix = matrix.tocsr()
+        for name in ("data", "indices", "indptr"):
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(matrix, name))
+        return {"format": "csr", "shape": list(matrix.shape)}
+
+    np.save(os.path.join(directory, "matrix.npy"), matrix)
+    return {"format": "dense", "shape": list(matrix.shape)}
+
+
+def load_matrix(directory, meta):
+    # memory-map a matrix written by save_matrix
+    if meta["format"] == "csr":
+        data, indices, indptr = (np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                                 for name in ("data", "indices", "indptr"))
+        return sparse.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]))
+    return np.load(os.path.join(directory, "matrix.npy"), mmap_mode="r")
+
+
+class MatrixCache:
+    # one directory per entry: the matrix as memory-mappable .npy files plus meta.json
+
+    def __init__(self, cache_dir, max_size=20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size  # bytes, least recently used entries are evicted beyond it
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(files, params):
+        # input files are identified by path, modification time and size
+        file_info = []
+        for file in files:
+            stat = os.stat(file)
+            file_info.append([os.path.abspath(file), stat.st_mtime_ns, stat.st_size])
+        content = json.dumps({"files": file_info, "params": params}, sort_keys=True)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def load(self, key):
+        entry = os.path.join(self.cache_dir, key)
+        meta_file = os.path.join(entry, "meta.json")
+        if not os.path.exists(meta_file):
+            return None
+
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        matrix = load_matrix(entry, meta)
+
+        os.utime(meta_file)  # mark as recently used
+        return matrix, meta["labels"]
+
+    def store(self, key, matrix, params=None, labels=None):
+        entry = os.path.join(self.cache_dir, key)
+        temp_entry = f"{entry}.tmp-{os.getpid()}"
+        meta = save_matrix(temp_entry, matrix)
+
+        with open(os.path.join(temp_entry, "meta.json"), 'w') as f:
+            json.dump({**meta, "params": params, "labels": labels}, f)
+
+        # publish the entry at once, another process may have stored the same key meanwhile
+        try:
+            os.rename(temp_entry, entry)
+        except OSError:
+            shutil.rmtree(temp_entry, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = []
+        total_size = 0
+        for key in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, key)
+            meta_file = os.path.join(entry, "meta.json")
+            if not os.path.exists(meta_file):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+            entries.append((os.path.getmtime(meta_file), size, key))
+            total_size += size
+
+        for _, size, key in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            logger.info(f"Evict cache entry: {key}")
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total_size -= size
+
+
+def cached_matrix(cache, files, params, build):
+    # build() returns (matrix, labels), which is skipped when the cache already has the entry
+    if cache is None:
+        return build()
+
+    key = cache.key(files, params)
+    with profiler.span("cache load"):
+        cached = cache.load(key)
+    if cached is not None:
+        logger.info(f"Load the matrix from cache: {os.path.join(cache.cache_dir, key)}")
+        return cached
+
+    matrix, labels = build()
+    with profiler.span("cache store"):
+        cache.store(key, matrix, params=params, labels=labels)
+    logger.info(f"Save the matrix to cache: {os.path.join(cache.cache_dir, key)}")
+    return matrix, labels
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Checkpoint.py
+@Time: 2025/04/16 09:40
+@Function: Checkpoint of a tiled .hic extraction, resumed after the process is stopped
+"""
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+from .logger import logger
+
+
+def block_crc(block):
+    # CRC32 of the float32 values of a matrix block
+    return zlib.crc32(np.ascontiguousarray(block, dtype=np.float32).data)
+
+
+class TileCheckpoint:
+    # a directory holding the matrix as a memory-mapped .npy file and manifest.json with the extraction parameters
+    # and the CRC32 of every finished tile; tiles are listed in the manifest only after the matrix file is flushed,
+    # so a stopped run leaves no tile listed that was not written
+
+    def __init__(self, directory, n_bins, params, flush_seconds=30, flush_tiles=32):
+        self.directory = directory
+        self.matrix_file = os.path.join(directory, "matrix.npy")
+        self.manifest_file = os.path.join(directory, "manifest.json")
+        self.params = params
+        self.n_bins = n_bins
+        self.flush_seconds = flush_seconds
+        self.flush_tiles = flush_tiles  # the manifest is written every flush_tiles tiles or flush_seconds seconds
+        self._unflushed = 0
+        self.tiles = {}  # "i,j": CRC32 of the tile in the matrix file
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = None
+        if os.path.exists(self.manifest_file) and os.path.exists(self.matrix_file):
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get("params") != params or manifest.get("n_bins") != n_bins:
+                logger.warning(f"The checkpoint {directory} is of another extraction, start a new one")
+                manifest = None
+
+        if manifest is None:
+            self.matrix = np.lib.format.open_memmap(self.matrix_file, mode="w+", dtype=np.float32,
+                                                    shape=(n_bins, n_bins))
+            self._write_manifest()
+        else:
+            self.matrix = np.load(self.matrix_file, mmap_mode="r+")
+            self.tiles = manifest["tiles"]
+            logger.info(f"Resume the checkpoint {directory}: {len(self.tiles)} tiles finished")
+
+    @staticmethod
+    def _key(i, j):
+        return f"{i},{j}"
+
+    def is_done(self, i, j):
+        return self._key(i, j) in self.tiles
+
+    def record(self, i, j, crc):
+        self.tiles[self._key(i, j)] = crc
+        self._unflushed += 1
+        if self._unflushed >= self.flush_tiles or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        # the matrix first, then the manifest listing its tiles, replaced at once
+        self.matrix.flush()
+        self._write_manifest()
+        self._last_flush = time.monotonic()
+        self._unflushed = 0
+
+    def _write_manifest(self):
+        temp_file = f"{self.manifest_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump({"params": self.params, "n_bins": self.n_bins, "tiles": self.tiles}, f)
+        os.replace(temp_file, self.manifest_file)
+
+    def verify(self, blocks):
+        # tiles whose blocks in the matrix file do not match their CRC32; they are dropped from the manifest
+        # blocks: (i, j) -> the block slices of the tile and of its mirror (None when not mirrored)
+        bad = []
+        for (i, j), (upper, lower) in blocks.items():
+            crc = self.tiles.get(self._key(i, j))
+            if crc is None:
+                bad.append((i, j))
+                continue
+            if block_crc(self.matrix[upper]) != crc or (lower is not None and block_crc(self.matrix[lower].T) != crc):
+                bad.append((i, j))
+                del self.tiles[self._key(i, j)]
+        if bad:
+            logger.warning(f"{len(bad)} tiles of the checkpoint {self.directory} failed the integrity check")
+            self.flush()
+        return bad
+
+    def result(self):
+        # the finished matrix, memory-mapped read-only so later in-place steps (e.g. normalization) copy it
+        self.flush()
+        del self.matrix
+        return np.load(self.matrix_file, mmap_mode="r")
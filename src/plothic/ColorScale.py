@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: ColorScale.py
+@Time: 2025/03/12 16:08
+@Function: Color range of the heatmap with bounded memory
+"""
+import numpy as np
+from scipy import sparse
+
+
+def _chunks(matrix, chunk_rows):
+    # finite values of the matrix in row chunks; for sparse input the stored values and the number of implicit
+    # zeros; NaN (e.g. the masked rows of a balanced matrix) and infinite values are left out as by np.nanpercentile
+    if sparse.issparse(matrix):
+        data = matrix.tocsr().data
+        yield data[np.isfinite(data)], matrix.shape[0] * matrix.shape[1] - len(data)
+        return
+    for row_start in range(0, matrix.shape[0], chunk_rows):
+        values = np.asarray(matrix[row_start:row_start + chunk_rows])
+        yield values[np.isfinite(values)], 0
+
+
+def _order_statistic(matrix, rank, low, high, n_bins, chunk_rows):
+    # narrow [low, high] twice to the histogram bin holding the rank-th smallest value
+    for _ in range(2):
+        if high - low <= np.spacing(max(abs(low), abs(high))) * n_bins:  # no finer float64 bins left
+            return (low + high) / 2
+        counts = np.zeros(n_bins, dtype=np.int64)
+        bin_range = (np.float64(low), np.float64(high))  # float64 edges also for float32 values
+        below = 0  # values under the current range
+        for values, zeros in _chunks(matrix, chunk_rows):
+            counts += np.histogram(values, bins=n_bins, range=bin_range)[0]
+            below += int(np.count_nonzero(values < low))
+            if zeros and low <= 0 <= high:
+                counts[min(int((0 - low) / (high - low) * n_bins), n_bins - 1)] += zeros
+            elif zeros and 0 < low:
+                below += zeros
+
+        k = min(int(np.searchsorted(below + np.cumsum(counts), rank, side="right")), n_bins - 1)
+        width = (high - low) / n_bins
+        low, high = low + k * width, low + (k + 1) * width
+
+    return (low + high) / 2
+
+
+def approx_percentile(matrix, q, n_bins=4096, chunk_rows=1024):
+    # percentile q (0-100) with linear interpolation as np.percentile, from streamed histograms,
+    # the result is within (max - min) / n_bins ** 2 of the exact value; 0 when the matrix has no finite value
+    low, high, total = np.inf, -np.inf, 0
+    for values, zeros in _chunks(matrix, chunk_rows):
+        if values.size:
+            low = min(low, float(values.min()))
+            high = max(high, float(values.max()))
+        if zeros:
+            low, high = min(low, 0.0), max(high, 0.0)
+        total += values.size + zeros
+    if total == 0:
+        return 0.0
+
+    rank = q / 100 * (total - 1)  # position of the percentile in the sorted values
+    lower = _order_statistic(matrix, int(np.floor(rank)), low, high, n_bins, chunk_rows)
+    if rank == int(rank):
+        return lower
+    upper = _order_statistic(matrix, int(np.ceil(rank)), low, high, n_bins, chunk_rows)
+    return lower + (upper - lower) * (rank - int(rank))
+
+
+def log_transform(matrix, inplace=False):
+    # log2(matrix + 1e-9), reusing the buffer of the matrix when it is owned by the caller
+    if not inplace or not np.issubdtype(matrix.dtype, np.floating):
+        matrix = np.array(matrix, dtype=np.float32)
+    np.add(matrix, 1e-9, out=matrix)
+    with np.errstate(divide='ignore'):
+        np.log2(matrix, out=matrix)
+    return matrix
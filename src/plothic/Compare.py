@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Compare.py
+@Time: 2025/04/10 11:12
+@Function: Plot several Hi-C samples side by side with a shared color scale and their ratio or difference maps
+"""
+import argparse
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+
+from .BinMTX import bin_factor, bin_matrix, scale_labels
+from .ColorScale import approx_percentile, log_transform
+from .Matrix import ContactMatrix
+from .Profile import profiler
+from .Raster import RASTER_FORMATS, colorize, draw_heatmap, output_format, save_canvas
+from .logger import logger
+
+COMPARE_MODES = ("ratio", "diff")
+
+
+def aligned_panels(matrices, n_pixels, reducer="mean", balance=None, oe=False):
+    # bin every matrix with the bins per pixel of the first one, so pixel i covers the same bins in all of them;
+    # the matrices are loaded, binned and released one by one, only the binned panels are kept
+    panels, labels, resolutions = [], [], []
+    factor = None
+    for matrix in matrices:
+        matrix = matrix.normalize(balance=balance, oe=oe)
+        if factor is None:
+            factor = bin_factor(len(matrix), n_pixels)
+        with profiler.span("bin", panel=len(panels)):
+            binned, _ = bin_matrix(matrix.evaluate(), n_pixels, reducer=reducer, factor=factor)
+        panels.append(np.asarray(binned, dtype=np.float32))
+        labels.append(scale_labels(matrix.labels(), factor))
+        resolutions.append(matrix.resolution)
+    if len(set(resolutions)) > 1:
+        logger.warning(f"The inputs have different resolutions: {resolutions}, the bins are compared by index")
+
+    # pad the smaller panels, pixels without data are shown in the 'bad' color of the color map
+    size = max(len(panel) for panel in panels)
+    for k, panel in enumerate(panels):
+        if len(panel) < size:
+            panels[k] = np.pad(panel, ((0, size - len(panel)), (0, size - len(panel))), constant_values=np.nan)
+    return panels, labels, factor
+
+
+def compare_panel(panel, reference, mode="ratio"):
+    # log2(panel / reference) where both are positive, or panel - reference
+    if mode == "diff":
+        return panel - reference
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.log2(panel / reference)
+    ratio[~((panel > 0) & (reference > 0))] = np.nan
+    return ratio
+
+
+def _finite(panels):
+    # finite values of all panels as one row, for a shared percentile
+    return np.concatenate([panel[np.isfinite(panel)] for panel in panels])[None, :]
+
+
+def _draw(ax, matrix, cmap, vmin, vmax, out_format, title, chr_info, rotation, font_size, grid):
+    rgba = colorize(matrix, cmap, vmin, vmax)
+    extents = len(matrix) + 0.5
+    ax.set_xlim(0.5, extents)
+    ax.set_ylim(0.5, extents)
+    draw_heatmap(ax, rgba, extents, out_format)
+    ax.set_title(title, fontsize=font_size + 4, pad=6)
+    pos = list(chr_info.values()) if chr_info else []
+    ax.set_xticks(pos)
+    ax.set_yticks(pos)
+    ax.set_xticklabels(list(chr_info) if chr_info else [])
+    ax.set_yticklabels(list(chr_info) if chr_info else [])
+    plt.setp(ax.get_xticklabels(), rotation=rotation, ha="right", rotation_mode="anchor", fontsize=font_size)
+    plt.setp(ax.get_yticklabels(), rotation=rotation, ha="right", rotation_mode="anchor", fontsize=font_size)
+    if grid:
+        ax.grid(color='black', linestyle='dashed', linewidth=1, alpha=0.8)
+
+
+def plot_compare(matrices, names, outfile="Compare.pdf", mode="ratio", fig_size=6, dpi=300, bar_min=0, bar_max=None,
+                 diff_max=None, cmap="YlOrRd", diff_cmap="RdBu_r", log=False, rotation=45, grid=True, genome_name="",
+                 reducer="mean", balance=None, oe=False, vector_dpi=150, font_size=10):
+    # matrices: ContactMatrix objects (a generator loads them one at a time); one figure with a row of the samples
+    # on a shared color scale and, for mode "ratio" or "diff", a row comparing every sample to the first one
+    if mode not in (None,) + COMPARE_MODES:
+        raise ValueError(f"Unknown compare mode: {mode}, choose from {COMPARE_MODES}")
+    out_format = output_format(outfile)
+    n_pixels = int(fig_size * (dpi if out_format in RASTER_FORMATS or not vector_dpi else vector_dpi))
+    panels, labels, factor = aligned_panels(matrices, n_pixels, reducer=reducer, balance=balance, oe=oe)
+    if len(panels) != len(names):
+        raise ValueError(f"{len(panels)} inputs but {len(names)} names")
+    if factor > 1:
+        logger.info(f"Bin the inputs to {len(panels[0])} x {len(panels[0])} pixels ({reducer} of {factor} x {factor} "
+                    f"bins)")
+
+    with profiler.span("color scale"):
+        if bar_max is None:
+            bar_max = approx_percentile(_finite(panels), 90)
+            logger.info(f"Max color is not set, use the shared max color: {bar_max}")
+        compared = []
+        if mode and len(panels) > 1:
+            compared = [compare_panel(panel, panels[0], mode=mode) for panel in panels[1:]]
+            if diff_max is None:
+                diff_max = approx_percentile(np.abs(_finite(compared)), 95) or 1.0
+                logger.info(f"Max {mode} is not set, use: {diff_max}")
+    logger.info(f"Color bar range: {bar_min} - {bar_max}")
+
+    n_rows = 2 if compared else 1
+    with profiler.span("render"):
+        fig, axes = plt.subplots(n_rows, len(panels), figsize=(fig_size * len(panels) * 1.1, fig_size * n_rows),
+                                 dpi=dpi, squeeze=False)
+        for k, panel in enumerate(panels):
+            if log:
+                panel = log_transform(panel)  # a new buffer, the linear panel is compared below
+            _draw(axes[0][k], panel, plt.get_cmap(cmap), bar_min, bar_max, out_format, names[k], labels[k],
+                  rotation, font_size, grid)
+        fig.colorbar(ScalarMappable(norm=Normalize(vmin=bar_min, vmax=bar_max), cmap=plt.get_cmap(cmap)),
+                     ax=axes[0].tolist(), fraction=0.02, pad=0.02)
+
+        if compared:
+            axes[1][0].set_axis_off()
+            title = "log2({} / {})" if mode == "ratio" else "{} - {}"
+            for k, panel in enumerate(compared, start=1):
+                _draw(axes[1][k], panel, plt.get_cmap(diff_cmap), -diff_max, diff_max, out_format,
+                      title.format(names[k], names[0]), labels[k], rotation, font_size, grid)
+            fig.colorbar(ScalarMappable(norm=Normalize(vmin=-diff_max, vmax=diff_max), cmap=plt.get_cmap(diff_cmap)),
+                         ax=axes[1].tolist(), fraction=0.02, pad=0.02)
+
+        if genome_name:
+            fig.suptitle(genome_name, fontsize=20, fontstyle='italic')
+
+    with profiler.span("save"):
+        if not (out_format in RASTER_FORMATS and save_canvas(fig, outfile, dpi)):
+            fig.savefig(outfile)
+    plt.close(fig)
+    logger.info(f"Save the plot to {outfile}")
+
+
+def _pick(values, k, option):
+    # one value for all inputs or one per input
+    if len(values) == 1:
+        return values[0]
+    if k >= len(values):
+        raise ValueError(f"Please set {option} once or once per input")
+    return values[k]
+
+
+def load_inputs(args, cache=None):
+    # ContactMatrix of every input, loaded when the comparison asks for it
+    if args.hic_file:
+        for k, hic in enumerate(args.hic_file):
+            if args.assembly:
+                yield ContactMatrix.from_assembly(hic, _pick(args.assembly, k, "--assembly"),
+                                                  asy_chr_num=args.asy_chr_num, resolution=args.resolution,
+                                                  data_type=args.data_type, normalization=args.normalization,
+                                                  tile_size=args.tile_size, threads=args.threads, cache=cache)
+            else:
+                yield ContactMatrix.from_hic(hic, _pick(args.chr_txt, k, "--chr-txt"), resolution=args.resolution,
+                                             data_type=args.data_type, normalization=args.normalization,
+                                             tile_size=args.tile_size, threads=args.threads, cache=cache)
+    else:
+        for k, matrix in enumerate(args.matrix):
+            abs_bed = _pick(args.abs_bed, k, "--abs-bed") if args.abs_bed else None
+            yield ContactMatrix.from_hicpro(matrix, abs_bed, cache=cache)
+
+
+def compare_main(argv=None):
+    parser = argparse.ArgumentParser(prog="plothic compare",
+                                     description='Plot Hi-C samples side by side with a shared color scale and '
+                                                 'their log2 ratio or difference to the first sample')
+    parser.add_argument('-hic', '--hic-file', type=str, nargs='+', default=None, help='Hi-C files to compare')
+    parser.add_argument('-chr', '--chr-txt', type=str, nargs='+', default=None,
+                        help='Chromosome text file, one for all Hi-C files or one per file')
+    parser.add_argument('-asy', '--assembly', type=str, nargs='+', default=None,
+                        help='.assembly files, one for all Hi-C files or one per file')
+    parser.add_argument('--asy-chr-num', type=int, default=None,
+                        help='Number of chromosomes at the top of the assembly file to show, default: all')
+    parser.add_argument('-matrix', type=str, nargs='+', default=None,
+                        help='HiCPro matrix files or store directories to compare')
+    parser.add_argument('--abs-bed', type=str, nargs='+', default=None,
+                        help='HiCPro abs bed file, one for all matrix files or one per file')
+    parser.add_argument('--names', type=str, nargs='+', default=None,
+                        help='Sample names, default: the input file names')
+    parser.add_argument('--mode', type=str, default='ratio', choices=['ratio', 'diff', 'none'],
+                        help='Second row: log2 ratio or difference to the first sample, or none, default: ratio')
+    parser.add_argument('-o', '--output', type=str, default='./', help='Output file or directory, default: ./')
+    parser.add_argument('-format', type=str, default="pdf", help='Output format for the figure, default: pdf')
+    parser.add_argument('-g', '--genome-name', type=str, default="", help='Title of the figure')
+    parser.add_argument('-r', '--resolution', type=int, default=None, help='Resolution for Hi-C data')
+    parser.add_argument('-d', '--data-type', type=str, default='observed', help='Data type for Hi-C data')
+    parser.add_argument('-n', '--normalization', type=str, default='NONE', help='Normalization method for Hi-C data')
+    parser.add_argument('--tile-size', type=int, default=1400,
+                        help='Number of bins per tile when extracting .hic data, default: 1400')
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help='Number of worker processes to fetch .hic tiles, default: 1')
+    parser.add_argument('--balance', type=str.upper, default=None, choices=['ICE', 'VC', 'VC_SQRT'],
+                        help='Balance every matrix before the comparison')
+    parser.add_argument('--oe', action='store_true', help='Compare the observed/expected matrices')
+    parser.add_argument('-log', action='store_true', help='Log2 transform the sample panels')
+    parser.add_argument('-cmap', type=str, default='YlOrRd', help='Color map of the samples, default: YlOrRd')
+    parser.add_argument('--diff-cmap', type=str, default='RdBu_r',
+                        help='Diverging color map of the ratio or difference, default: RdBu_r')
+    parser.add_argument('-f', '--fig-size', type=int, default=6, help='Size of every panel, default: 6')
+    parser.add_argument('-dpi', type=int, default=300, help='DPI for the output figure, default: 300')
+    parser.add_argument('--bar-min', type=float, default=0, help='Minimum value for color bar, default: 0')
+    parser.add_argument('--bar-max', type=float, default=None,
+                        help='Maximum value for color bar, default: the 90th percentile of all samples')
+    parser.add_argument('--diff-max', type=float, default=None,
+                        help='Color bar range (+/-) of the ratio or difference, default: its 95th percentile')
+    parser.add_argument('-rotation', type=int, default=45, help='Rotation for the axis labels, default: 45')
+    parser.add_argument('-grid', action='store_false', help='Show grid in the heatmap, Default: True')
+    parser.add_argument('--reducer', type=str, default='mean', choices=['sum', 'mean', 'max'],
+                        help='How to merge matrix bins into one figure pixel, default: mean')
+    parser.add_argument('--vector-dpi', type=int, default=150,
+                        help='DPI of the heatmap images embedded in vector figures, default: 150')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Cache the extracted matrices in this directory, re-plots skip the extraction')
+    parser.add_argument('--cache-size', type=float, default=20,
+                        help='Maximum size of the cache directory in GB, default: 20')
+    args = parser.parse_args(argv)
+
+    inputs = args.hic_file or args.matrix
+    if not inputs or (args.hic_file and not (args.chr_txt or args.assembly)):
+        parser.error("Please set the Hi-C files with -chr or -asy, or the HiCPro matrix files")
+    names = args.names or [os.path.basename(os.path.normpath(path)).split(".")[0] for path in inputs]
+
+    from .Cache import MatrixCache
+
+    cache = MatrixCache(args.cache_dir, max_size=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    output = os.path.join(args.output, f"Compare.{args.format}") if os.path.isdir(args.output) else args.output
+    plot_compare(load_inputs(args, cache=cache), names, outfile=output,
+                 mode=None if args.mode == "none" else args.mode, fig_size=args.fig_size, dpi=args.dpi,
+                 bar_min=args.bar_min, bar_max=args.bar_max, diff_max=args.diff_max, cmap=args.cmap,
+                 diff_cmap=args.diff_cmap, log=args.log, rotation=args.rotation, grid=args.grid,
+                 genome_name=args.genome_name, reducer=args.reducer, balance=args.balance, oe=args.oe,
+                 vector_dpi=args.vector_dpi)
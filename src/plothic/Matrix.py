@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Matrix.py
+@Time: 2025/04/08 14:25
+@Function: Contact matrix object of the Python API, loaded once and plotted many times
+"""
+import copy
+
+from scipy import sparse
+
+from .BinMTX import bin_factor, bin_matrix
+from .ColorScale import log_transform
+from .Normalize import normalize_matrix
+from .Reorder import BlockReorder, reorder_matrix
+from .Store import load_contacts
+
+
+def _materialize(matrix, owned):
+    # a lazily reordered matrix as one array, for the transforms that need the values in place
+    if isinstance(matrix, BlockReorder):
+        return matrix.toarray(), True
+    return matrix, owned
+
+
+def _hic_bounds(chr_info, matrix_len):
+    # (name, start bin, end bin) of the chromosomes of plot_hic, from their end loci in the hic file
+    last_chr_len = max(chr_info[i]["hic_loci"] for i in chr_info)
+    chroms = []
+    start = 0
+    for i in chr_info:
+        end = chr_info[i]["hic_loci"] * matrix_len // last_chr_len
+        chroms.append((chr_info[i]["name"], start, end))
+        start = end
+    return chroms
+
+
+class ContactMatrix:
+    # a loaded contact matrix (scipy sparse, NumPy array or memmap) with its chromosome bins, and a chain of lazy
+    # transforms; every transform returns a new object sharing the loaded data, the chain is evaluated once on
+    # the first render (or evaluate()) and the result is kept for the next renders of the same object
+    #   size: bins per side after the transforms
+    #   names, bounds: chromosome names and their (start, end) bins in the matrix, in matrix order
+    #   resolution: bp per bin, None when unknown
+
+    def __init__(self, data, names, bounds, resolution=None):
+        self.data = data
+        self.size = data.shape[0]
+        self.names = list(names)
+        self.bounds = [(int(start), int(end)) for start, end in bounds]
+        self.resolution = resolution
+        self.log_scale = False  # log2 after the binning of plot_matrix, as -log
+        self._parent = None
+        self._op = None  # (matrix, owned) -> (matrix, owned), owned: the buffer may be changed in place
+        self._result = None
+
+    @classmethod
+    def from_hicpro(cls, matrix_file, abs_bed=None, cache=None):
+        # HiCPro matrix and abs bed files, or a store directory made by "plothic convert"
+        matrix, chr_info = load_contacts(matrix_file, abs_bed, cache=cache)
+        return cls(matrix, list(chr_info), [(chr_info[i]["start"], chr_info[i]["index"]) for i in chr_info],
+                   resolution=next(iter(chr_info.values()))["bin_size"] if chr_info else None)
+
+    @classmethod
+    def from_hic(cls, hic, chr_txt, resolution=None, data_type="observed", normalization="NONE", tile_size=1400,
+                 threads=1, cache=None):
+        # the 'assembly' matrix of a .hic file, chromosomes from the chromosome text file of plot_hic
+        from .ParseHiC import read_chr_txt
+
+        return cls._load_hic(hic, read_chr_txt(chr_txt), resolution, data_type, normalization, tile_size, threads,
+                             cache)
+
+    @classmethod
+    def from_assembly(cls, hic, assembly, asy_chr_num=None, resolution=None, data_type="observed",
+                      normalization="NONE", tile_size=1400, threads=1, cache=None):
+        # the 'assembly' matrix of a .hic file, chromosomes from its Juicebox .assembly file
+        import hicstraw
+
+        from .ParseAsy import assembly_chr_info
+
+        chr_info = assembly_chr_info(hicstraw.HiCFile(hic), hic, assembly, asy_chr_num=asy_chr_num)
+        return cls._load_hic(hic, chr_info, resolution, data_type, normalization, tile_size, threads, cache)
+
+    @classmethod
+    def _load_hic(cls, hic, chr_info, resolution, data_type, normalization, tile_size, threads, cache):
+        import hicstraw
+
+        from .ParseHiC import choose_resolution, load_hic
+
+        resolution = choose_resolution(hicstraw.HiCFile(hic), resolution)
+        matrix = load_hic(hic, resolution, matrix_end=max(chr_info[i]["hic_loci"] for i in chr_info),
+                          data_type=data_type, normalization=normalization, tile_size=tile_size, threads=threads,
+                          cache=cache)
+        chroms = _hic_bounds(chr_info, len(matrix))
+        return cls(matrix, [name for name, _, _ in chroms], [(start, end) for _, start, end in chroms],
+                   resolution=resolution)
+
+    @property
+    def shape(self):
+        return self.size, self.size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return (f"ContactMatrix({self.shape[0]} x {self.shape[1]} bins, {len(self.names)} chromosomes, "
+                f"resolution {self.resolution}, log {self.log_scale})")
+
+    def labels(self):
+        # chromosome name: end bin, the chr_info of plot_matrix
+        return {name: end for name, (_, end) in zip(self.names, self.bounds)}
+
+    def _derive(self, op=None, **meta):
+        # a new object one transform further down the chain, metadata updated now, the values on evaluation
+        matrix = copy.copy(self)
+        matrix._parent = self
+        matrix._op = op
+        matrix._result = None
+        for name, value in meta.items():
+            setattr(matrix, name, value)
+        return matrix
+
+    def reorder(self, order):
+        # chromosomes (names or indices) in the new order, chromosomes left out are dropped
+        index = [self.names.index(chrom) if isinstance(chrom, str) else int(chrom) for chrom in order]
+        bounds = [self.bounds[k] for k in index]
+
+        def op(matrix, owned):
+            if sparse.issparse(matrix):
+                return reorder_matrix(matrix, bounds, list(range(len(bounds)))), True
+            matrix, owned = _materialize(matrix, owned)
+            return BlockReorder(matrix, bounds, list(range(len(bounds)))), False  # the blocks are views
+
+        new_bounds = []
+        start = 0
+        for chrom_start, chrom_end in bounds:
+            new_bounds.append((start, start + chrom_end - chrom_start))
+            start += chrom_end - chrom_start
+        return self._derive(op, size=start, names=[self.names[k] for k in index], bounds=new_bounds)
+
+    def subset(self, chroms):
+        # the chromosomes (a name or a list of names) in their current order
+        chroms = {chroms} if isinstance(chroms, str) else set(chroms)
+        missing = chroms.difference(self.names)
+        if missing:
+            raise ValueError(f"Chromosomes {sorted(missing)} not in the matrix: {self.names}")
+        return self.reorder([name for name in self.names if name in chroms])
+
+    def normalize(self, balance=None, oe=False):
+        # matrix balancing (ICE, VC, VC_SQRT) and / or observed / expected per chromosome, as --balance and --oe
+        if not balance and not oe:
+            return self
+        bounds = list(self.bounds)
+
+        def op(matrix, owned):
+            matrix, owned = _materialize(matrix, owned)
+            return normalize_matrix(matrix, balance=balance, oe=oe, bounds=bounds, inplace=owned), True
+
+        return self._derive(op)
+
+    def log(self):
+        # log2 of the values; shares the evaluated matrix with the linear object, the log is taken when plotted
+        return self._derive(log_scale=True)
+
+    def downsample(self, max_bins, reducer="mean"):
+        # merge factor x factor bins (sum, mean or max) so the matrix has at most max_bins bins per side
+        factor = bin_factor(len(self), max_bins)
+        if factor == 1:
+            return self
+        size = -(-len(self) // factor)
+
+        def op(matrix, owned):
+            binned, _ = bin_matrix(matrix, max_bins, reducer=reducer)
+            return binned, True
+
+        bounds = [(min(size, round(start / factor)), min(size, round(end / factor))) for start, end in self.bounds]
+        resolution = self.resolution * factor if self.resolution else None
+        return self._derive(op, size=size, bounds=bounds, resolution=resolution)
+
+    def evaluate(self):
+        # the values after every transform (the log excepted), computed once; the loaded data is never changed
+        if self._result is not None:
+            return self._result
+        if self._parent is not None and self._op is None:  # same values as the parent, e.g. the log object
+            self._result = self._parent.evaluate()
+            return self._result
+
+        ops = []
+        node = self
+        while node._parent is not None and node._result is None:
+            if node._op is not None:
+                ops.append(node._op)
+            node = node._parent
+        matrix = node.data if node._parent is None else node._result
+        owned = False  # the loaded data and the results kept by other objects are shared
+        for op in reversed(ops):
+            matrix, owned = op(matrix, owned)
+        self._result = matrix
+        return matrix
+
+    def toarray(self):
+        # dense values, the log included
+        matrix, owned = _materialize(self.evaluate(), False)
+        if sparse.issparse(matrix):
+            matrix, owned = matrix.toarray(), True
+        return log_transform(matrix, inplace=owned) if self.log_scale else matrix
+
+    def plot(self, outfile, **kwargs):
+        # plot_matrix of this matrix, its chromosome labels unless chr_info is given
+        from .PlotMTX import plot_matrix
+
+        plot_matrix(self, outfile=outfile, **kwargs)
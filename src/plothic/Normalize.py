@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Normalize.py
+@Time: 2025/03/18 10:36
+@Function: Balance the contact matrix and compute observed/expected on sparse or dense data
+"""
+import numpy as np
+from scipy import sparse
+
+from .logger import logger
+
+BALANCE_METHODS = ("ICE", "VC", "VC_SQRT")
+
+
+def _records(matrix, chunk_size=1 << 22):
+    # (row, col, value, part) of about chunk_size records at a time,
+    # part is the data slice (sparse) or the row slice (dense) of the records
+    n_bins = matrix.shape[0]
+    if sparse.issparse(matrix):
+        for start in range(0, matrix.nnz, chunk_size):
+            end = min(matrix.nnz, start + chunk_size)
+            row = np.searchsorted(matrix.indptr, np.arange(start, end), side="right") - 1
+            yield row, matrix.indices[start:end], matrix.data[start:end], slice(start, end)
+        return
+
+    chunk_rows = max(1, chunk_size // max(1, n_bins))
+    col = np.tile(np.arange(n_bins), chunk_rows)
+    for row_start in range(0, n_bins, chunk_rows):
+        block = np.asarray(matrix[row_start:row_start + chunk_rows])
+        row = np.repeat(np.arange(row_start, row_start + block.shape[0]), n_bins)
+        yield row, col[:block.size], block.ravel(), slice(row_start, row_start + block.shape[0])
+
+
+def _matvec(matrix, vector, chunk_size=1 << 22):
+    if sparse.issparse(matrix):
+        return matrix @ vector
+    out = np.empty(matrix.shape[0])
+    chunk_rows = max(1, chunk_size // max(1, matrix.shape[0]))
+    for row_start in range(0, matrix.shape[0], chunk_rows):
+        out[row_start:row_start + chunk_rows] = matrix[row_start:row_start + chunk_rows] @ vector
+    return out
+
+
+def _new_output(matrix, inplace):
+    # sparse output shares the structure of the input, dense output is a float32 buffer
+    if sparse.issparse(matrix):
+        out = matrix.copy()
+        out.data = out.data.astype(np.float32)
+        return out
+    if inplace and matrix.dtype == np.float32 and matrix.flags.writeable:
+        return matrix
+    return np.empty(matrix.shape, dtype=np.float32)
+
+
+def _target(out, part):
+    return out.data[part] if sparse.issparse(out) else out[part].reshape(-1)
+
+
+def balance_bias(matrix, method="ICE", max_iter=200, tol=1e-5):
+    # bias of every bin, the balanced matrix is bias[i] * matrix[i, j] * bias[j]; empty bins get a bias of 0
+    method = method.upper()
+    if method not in BALANCE_METHODS:
+        raise ValueError(f"Unknown balance method: {method}, choose from {BALANCE_METHODS}")
+
+    coverage = _matvec(matrix, np.ones(matrix.shape[0]))
+    mask = coverage > 0
+    bias = np.zeros(matrix.shape[0])
+    if method == "VC":
+        bias[mask] = 1 / coverage[mask]
+    elif method == "VC_SQRT":
+        bias[mask] = 1 / np.sqrt(coverage[mask])
+    else:
+        # iterative correction: divide the bias by the square root of the relative row sums until all row sums
+        # are equal, the square root splits the correction between rows and columns and stops it from oscillating
+        bias[mask] = 1
+        for iteration in range(1, max_iter + 1):
+            row_sum = bias * _matvec(matrix, bias)
+            row_sum = row_sum[mask] / row_sum[mask].mean()
+            bias[mask] /= np.sqrt(row_sum)
+            if row_sum.var() < tol:
+                logger.info(f"ICE balancing converged after {iteration} iterations")
+                break
+        else:
+            logger.warning(f"ICE balancing did not converge after {max_iter} iterations")
+
+    # keep the total number of contacts, so the color bar stays in contact counts
+    balanced_total = bias @ _matvec(matrix, bias)
+    if balanced_total > 0:
+        bias *= np.sqrt(coverage.sum() / balanced_total)
+    return bias
+
+
+def apply_bias(matrix, bias, inplace=False):
+    out = _new_output(matrix, inplace)
+    for row, col, value, part in _records(matrix):
+        _target(out, part)[:] = value * bias[row] * bias[col]
+    return out
+
+
+def _chrom_index(n_bins, bounds):
+    # chromosome of every bin and chromosome lengths, bounds: (start, end) bins of each chromosome
+    starts = sorted({0} | {start for start, _ in bounds or [] if 0 < start < n_bins})
+    chrom = np.searchsorted(starts, np.arange(n_bins), side="right") - 1
+    return chrom, np.diff(starts + [n_bins])
+
+
+def expected(matrix, bounds=None):
+    # mean contacts of intra-chromosome bin pairs at each distance (diagonal sums / pairs),
+    # and of inter-chromosome bin pairs
+    n_bins = matrix.shape[0]
+    chrom, lengths = _chrom_index(n_bins, bounds)
+
+    cis_sum = np.zeros(n_bins)
+    trans_sum = 0.0
+    for row, col, value, _ in _records(matrix):
+        cis = chrom[row] == chrom[col]
+        cis_sum += np.bincount(np.abs(row[cis] - col[cis]), weights=value[cis], minlength=n_bins)
+        trans_sum += float(value[~cis].sum())
+
+    # pairs at distance d: sum over chromosomes longer than d of (length - d), counted in both triangles
+    len_count = np.bincount(lengths, minlength=n_bins + 1)[::-1]
+    longer = np.cumsum(len_count)[::-1][1:]  # chromosomes longer than d
+    longer_len = np.cumsum(len_count * np.arange(n_bins, -1, -1))[::-1][1:]
+    pairs = (longer_len - np.arange(n_bins) * longer) * 2.0
+    pairs[0] /= 2
+
+    cis_expected = np.divide(cis_sum, pairs, out=np.zeros(n_bins), where=pairs > 0)
+    trans_pairs = float(n_bins) ** 2 - float((lengths.astype(np.float64) ** 2).sum())
+    trans_expected = trans_sum / trans_pairs if trans_pairs > 0 else 0.0
+    return cis_expected, trans_expected
+
+
+def observed_expected(matrix, bounds=None, inplace=False):
+    cis_expected, trans_expected = expected(matrix, bounds)
+    chrom, _ = _chrom_index(matrix.shape[0], bounds)
+
+    out = _new_output(matrix, inplace)
+    for row, col, value, part in _records(matrix):
+        divisor = np.where(chrom[row] == chrom[col], cis_expected[np.abs(row - col)], trans_expected)
+        _target(out, part)[:] = np.divide(value, divisor, out=np.zeros(len(value)), where=divisor > 0)
+    return out
+
+
+def normalize_matrix(matrix, balance=None, oe=False, bounds=None, inplace=False):
+    # balance first, then divide by the distance-decay expected of the balanced matrix
+    if balance:
+        logger.info(f"Balance the matrix with {balance}")
+        if sparse.issparse(matrix):
+            matrix = matrix.tocsr()
+        matrix = apply_bias(matrix, balance_bias(matrix, balance), inplace=inplace)
+        inplace = True
+    if oe:
+        logger.info("Compute the observed/expected matrix")
+        if sparse.issparse(matrix):
+            matrix = matrix.tocsr()
+        matrix = observed_expected(matrix, bounds, inplace=inplace)
+    return matrix
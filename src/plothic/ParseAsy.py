@@ -8,49 +8,147 @@
 @Time: 2024/11/12 15:54
 @Function: Parse assembly file to get the chromosome information
 """
+import os
+
+import numpy as np
 
 from .logger import logger
 
 
-def parse_assembly(assembly_file):
-    scaffold_info = {}  # scaffold information
-    chr_info = {}  # chromosome information
+class Assembly:
+    # scaffold and chromosome tables of a Juicebox .assembly file as arrays
+    #   scaffold_names, scaffold_lengths: indexed by scaffold index - 1
+    #   chrom_scaffolds: signed scaffold indices of all chromosomes (negative: reversed), in order
+    #   chrom_offsets: prefix sums, chromosome k holds chrom_scaffolds[chrom_offsets[k]:chrom_offsets[k + 1]]
+
+    def __init__(self, scaffold_names, scaffold_lengths, chrom_scaffolds, chrom_offsets):
+        self.scaffold_names = scaffold_names
+        self.scaffold_lengths = scaffold_lengths
+        self.chrom_scaffolds = chrom_scaffolds
+        self.chrom_offsets = chrom_offsets
+
+        # chromosome lengths by one reduceat over the scaffold lengths, ends are their prefix sums
+        lengths = scaffold_lengths[np.abs(chrom_scaffolds) - 1]
+        starts = chrom_offsets[:-1]
+        self.chrom_lengths = np.add.reduceat(lengths, starts) if len(lengths) else np.zeros(0, dtype=np.int64)
+        self.chrom_lengths[starts == chrom_offsets[1:]] = 0  # reduceat of an empty chromosome
+        self.chrom_ends = np.cumsum(self.chrom_lengths)
+
+    @property
+    def n_chroms(self):
+        return len(self.chrom_lengths)
+
+    @property
+    def total_length(self):
+        return int(self.chrom_ends[-1]) if self.n_chroms else 0
+
+    def orientations(self, chrom):
+        # scaffold indices and orientations (+1 / -1) of one chromosome (0-based)
+        scaffolds = self.chrom_scaffolds[self.chrom_offsets[chrom]:self.chrom_offsets[chrom + 1]]
+        return np.abs(scaffolds), np.sign(scaffolds)
+
+    def save(self, cache_file, source):
+        np.savez(cache_file, scaffold_names=self.scaffold_names, scaffold_lengths=self.scaffold_lengths,
+                 chrom_scaffolds=self.chrom_scaffolds, chrom_offsets=self.chrom_offsets, source=np.array(source))
+
+    @classmethod
+    def load(cls, cache_file, source):
+        # None when the cache was made from another version of the assembly file
+        with np.load(cache_file) as data:
+            if str(data["source"]) != source:
+                return None
+            return cls(data["scaffold_names"], data["scaffold_lengths"], data["chrom_scaffolds"],
+                       data["chrom_offsets"])
+
+    def chr_info(self, hic_length, chr_num=None, prefix="Chr"):
+        # chromosome information in the layout of the chromosome text file of plot_hic, for the first chr_num
+        # chromosomes; the 'assembly' pseudo-chromosome of the .hic file is the assembly divided by a scale
+        scale = max(1, round(self.total_length / hic_length)) if hic_length else 1
+        chr_num = self.n_chroms if chr_num is None else min(chr_num, self.n_chroms)
+        hic_ends = self.chrom_ends[:chr_num] // scale
+        hic_starts = np.concatenate(([0], hic_ends[:-1]))
+        logger.info(f"Assembly scale in the hic file: {scale}, use {chr_num} of {self.n_chroms} chromosomes")
+
+        chr_info = {}
+        for k in range(chr_num):
+            chr_info[str(k + 1)] = {
+                "length": int(hic_ends[k] - hic_starts[k]),  # chromosome length in hic file
+                "name": f"{prefix}{k + 1}",
+                "hic_loci": int(hic_ends[k])  # chromosome loci in hic file
+            }
+        return chr_info
+
 
-    # Parse assembly file
+def read_assembly(assembly_file):
+    # the scaffold lines (>name index length) come first, then one line of signed scaffold indices per chromosome
     with open(assembly_file, 'r') as f:
-        chr_count = 1  # chromosome number
-        for line in f:
-            stripped_line = line.strip()
-            if stripped_line.startswith('>'):
-                parts = stripped_line.split(" ")
-                scaffold_name = parts[0][1:]
-                scaffold_index = int(parts[1])
-                scaffold_asy_len = int(parts[2])
-                scaffold_info[scaffold_index] = {
-                    "scaffold_name": scaffold_name,
-                    "scaffold_asy_len": scaffold_asy_len
-                }
-            else:
-                chr_info[chr_count] = {
-                    "scaffold_index": stripped_line
-                }
-                chr_count += 1
-
-    all_chr_len = 0
-
-    # Calculate each chromosome length
-    for chr_num, info in chr_info.items():
-        scaffold_indices = map(int, info["scaffold_index"].split(" "))
-        chr_len = sum(scaffold_info[abs(index)]["scaffold_asy_len"] for index in scaffold_indices)
-        chr_info[chr_num]["chr_len"] = chr_len
-        all_chr_len += chr_len
+        text = f.read()
+    split = 0  # end of the scaffold lines
+    if "\n>" in text or text.startswith(">"):
+        line_end = text.find("\n", text.rfind("\n>") + 1)  # after the last scaffold line
+        split = len(text) if line_end < 0 else line_end + 1
+
+    # scaffold table, the numbers are parsed in C by np.fromstring
+    fields = text[:split].split()
+    scaffold_index = np.fromstring(" ".join(fields[1::3]), dtype=np.int64, sep=" ")
+    names = np.array(" ".join(fields[0::3])[1:].split(" >"))  # drop the '>' of every name
+    scaffold_names = np.empty(len(scaffold_index), dtype=names.dtype)
+    scaffold_lengths = np.zeros(len(scaffold_index), dtype=np.int64)
+    scaffold_names[scaffold_index - 1] = names
+    scaffold_lengths[scaffold_index - 1] = np.fromstring(" ".join(fields[2::3]), dtype=np.int64, sep=" ")
+
+    # chromosome lines of signed scaffold indices, flattened with the prefix sums of their sizes
+    chroms = [np.fromstring(line, dtype=np.int64, sep=" ") for line in text[split:].splitlines() if line.strip()]
+    chrom_scaffolds = np.concatenate(chroms) if chroms else np.zeros(0, dtype=np.int64)
+    chrom_offsets = np.concatenate(([0], np.cumsum([len(chrom) for chrom in chroms], dtype=np.int64)))
+
+    assembly = Assembly(scaffold_names, scaffold_lengths, chrom_scaffolds, chrom_offsets)
+    logger.info(f"The number of scaffolds: {len(scaffold_lengths)}")
+    logger.info(f"The number of chromosomes: {assembly.n_chroms}")
+    logger.info(f"Total length of all chromosomes: {assembly.total_length}")
+    return assembly
+
+
+def load_assembly(assembly_file, hic=None):
+    # the parsed layout is cached next to the .hic file (or the assembly file) and reused while the file is unchanged
+    stat = os.stat(assembly_file)
+    source = f"{os.path.abspath(assembly_file)}:{stat.st_mtime_ns}:{stat.st_size}"
+    cache_file = f"{hic if hic else assembly_file}.layout.npz"
+    if os.path.exists(cache_file):
+        assembly = Assembly.load(cache_file, source)
+        if assembly is not None:
+            logger.info(f"Load the assembly layout from {cache_file}")
+            return assembly
+
+    assembly = read_assembly(assembly_file)
+    try:
+        assembly.save(cache_file, source)
+    except OSError as e:
+        logger.warning(f"Can not cache the assembly layout to {cache_file}: {e}")
+    return assembly
+
+
+def assembly_chr_info(hic_obj, hic, assembly_file, asy_chr_num=None):
+    # chromosome information of the .assembly file, scaled to the 'assembly' pseudo-chromosome of the hic file
+    hic_length = {chrom.name: chrom.length for chrom in hic_obj.getChromosomes()}.get("assembly")
+    if hic_length is None:
+        logger.warning("No 'assembly' pseudo-chromosome in the hic file, use the assembly coordinates")
+    return load_assembly(assembly_file, hic=hic).chr_info(hic_length, chr_num=asy_chr_num)
+
+
+def parse_assembly(assembly_file):
+    assembly = read_assembly(assembly_file)
+    chr_info = {}  # chromosome information
+    for k in range(assembly.n_chroms):
+        scaffolds = assembly.chrom_scaffolds[assembly.chrom_offsets[k]:assembly.chrom_offsets[k + 1]]
+        chr_info[k + 1] = {
+            "scaffold_index": " ".join(map(str, scaffolds)),
+            "chr_len": int(assembly.chrom_lengths[k])
+        }
 
     all_chr_info = {
-        "chr_count": chr_count - 1,
-        "all_chr_len": all_chr_len
+        "chr_count": assembly.n_chroms,
+        "all_chr_len": assembly.total_length
     }
 
-    logger.info(f"The number of chromosomes: {chr_count - 1}")
-    logger.info(f"Total length of all chromosomes: {all_chr_len}")
-
     return chr_info, all_chr_info
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: ParseBed.py
+@Time: 2025/01/14 10:21
+@Function: Parse HiCPro format data
+"""
+import gzip
+from itertools import islice
+
+import numpy as np
+from scipy import sparse
+
+from .Cache import cached_matrix
+from .Profile import profiler
+from .logger import logger
+
+# one HiCPro triplet: bin1 bin2 count (1-based bins)
+TRIPLET_DTYPE = np.dtype([("row", np.int32), ("col", np.int32), ("count", np.float32)])
+
+
+def open_text(file):
+    # plain or gzip compressed text file
+    return gzip.open(file, 'rt') if file.endswith(".gz") else open(file, 'r')
+
+
+def parse_abs_bed(abs_bed):
+    chr_info = {}  # chrom name: {"length": last bin end, "start": first bin index, "index": last bin id, "bin_size"}
+    with open_text(abs_bed) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            line = line.strip().split()
+            if not line:
+                continue
+            if line[0] not in chr_info:
+                chr_info[line[0]] = {"start": int(line[3]) - 1, "bin_size": int(line[2]) - int(line[1])}
+            chr_info[line[0]]["length"] = int(line[2])
+            chr_info[line[0]]["index"] = int(line[3])
+
+    return chr_info
+
+
+def read_triplets(matrix_file, chunk_size=5000000):
+    # yield (row, col, count) arrays of at most chunk_size records, bins converted to 0-based
+    with open_text(matrix_file) as f:
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                break
+            records = np.loadtxt(lines, dtype=TRIPLET_DTYPE, comments="#", ndmin=1)
+            yield records["row"] - 1, records["col"] - 1, records["count"]
+
+
+def parse_matrix(matrix_file, n_bins=None, chunk_size=5000000, chrom_starts=None):
+    # chrom_starts: sorted first bins of the chromosomes, only intra-chromosome records are kept when set
+    rows, cols, counts = [], [], []
+    max_bin = 0
+    for row, col, count in read_triplets(matrix_file, chunk_size=chunk_size):
+        if chrom_starts is not None:
+            intra = np.searchsorted(chrom_starts, row, side="right") == np.searchsorted(chrom_starts, col, side="right")
+            row, col, count = row[intra], col[intra], count[intra]
+        rows.append(row)
+        cols.append(col)
+        counts.append(count)
+        if len(row):
+            max_bin = max(max_bin, int(row.max()) + 1, int(col.max()) + 1)
+
+    row = np.concatenate(rows) if rows else np.empty(0, dtype=np.int32)
+    col = np.concatenate(cols) if cols else np.empty(0, dtype=np.int32)
+    count = np.concatenate(counts) if counts else np.empty(0, dtype=np.float32)
+    del rows, cols, counts
+
+    n_bins = max_bin if n_bins is None else max(n_bins, max_bin)
+    logger.info(f"Read {len(count)} contact records, {n_bins} bins")
+
+    # HiCPro only stores the upper triangle, mirror the off-diagonal records
+    off_diag = row != col
+    matrix = sparse.coo_matrix((np.concatenate((count, count[off_diag])),
+                                (np.concatenate((row, col[off_diag])), np.concatenate((col, row[off_diag])))),
+                               shape=(n_bins, n_bins), dtype=np.float32)
+
+    return matrix.tocsr()
+
+
+def load_hicpro(matrix_file, abs_bed, cache=None, intra_only=False):
+    # intra_only: drop the inter-chromosome records, e.g. when the chromosomes are plotted one by one
+    def load():
+        with profiler.span("parse abs bed"):
+            chr_info = parse_abs_bed(abs_bed)
+        chrom_starts = np.sort([chr_info[i]["start"] for i in chr_info]) if intra_only else None
+        with profiler.span("parse matrix"):
+            return parse_matrix(matrix_file, n_bins=max(chr_info[i]["index"] for i in chr_info),
+                                chrom_starts=chrom_starts), chr_info
+
+    # the chromosome information is cached together with the matrix
+    params = {"source": "hicpro", "intra_only": True} if intra_only else {"source": "hicpro"}
+    return cached_matrix(cache, [matrix_file, abs_bed], params, load)
@@ -8,41 +8,326 @@
 @Time: 2024/11/12 19:33
 @Function: Parse Hi-C data
 """
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 
-import hicstraw
 import numpy as np
 
+from .Cache import cached_matrix
+from .Checkpoint import TileCheckpoint, block_crc
+from .Profile import profiler
+from .logger import logger
+
+# hicstraw is imported by the functions opening a .hic file, the tile assembly (e.g. of the offline benchmarks on
+# mock zoom data) works without it
+_worker_matrix = None  # zoom data object of a tile fetching worker process
+_worker_groups = None  # group of every bin, for the workers of summarize_matrix
+
+
+def open_matrix(hic, resolution, data_type="observed", normalization="NONE", chrom="assembly"):
+    import hicstraw
+
+    hic_obj = hicstraw.HiCFile(hic)
+    return hic_obj.getMatrixZoomData(chrom, chrom, data_type, normalization, "BP", resolution)
+
+
+def alloc_matrix(n_bins, memmap_file=None):
+    # one float32 array for the whole matrix, optional backed by a .npy file on disk
+    if memmap_file is None:
+        return np.zeros((n_bins, n_bins), dtype=np.float32)
+    logger.info(f"Use memory-mapped matrix file: {memmap_file}")
+    return np.lib.format.open_memmap(memmap_file, mode="w+", dtype=np.float32, shape=(n_bins, n_bins))
+
+
+def region_bins(start, end, resolution):
+    # bins overlapping the bp window [start, end), as a half-open bin range
+    start_bin = start // resolution
+    end_bin = max(start_bin + 1, -(-end // resolution))
+    return start_bin, end_bin
+
+
+def tile_edges(start_bin, end_bin, tile_size):
+    # bin boundaries of the tiles covering [start_bin, end_bin)
+    return list(range(start_bin, end_bin, tile_size)) + [end_bin]
+
+
+def _init_worker(opener, groups=None):
+    # every worker process reads the .hic file through its own handle
+    global _worker_matrix, _worker_groups
+    _worker_matrix = opener()
+    _worker_groups = groups
+
+
+def _fetch_worker(region):
+    return _worker_matrix.getRecordsAsMatrix(*region)
+
+
+def bounded_map(executor, fn, tasks, window):
+    # results of fn over the tasks in order, like executor.map, but with at most window tasks submitted and not
+    # yet consumed, so finished tiles do not pile up in the main process while it places the earlier ones
+    tasks = iter(tasks)
+    pending = deque(executor.submit(fn, task) for task in islice(tasks, window))
+    while pending:
+        result = pending.popleft().result()
+        for task in islice(tasks, 1):  # top up the window before the result is consumed
+            pending.append(executor.submit(fn, task))
+        yield result
+
+
+def _put_tile(out, tile, edges, i, j, start_bin, symmetric):
+    if tile.size == 0:
+        return
+    row_start = edges[i] - start_bin
+    col_start = edges[j] - start_bin
+    rows = min(tile.shape[0], edges[i + 1] - edges[i])
+    cols = min(tile.shape[1], edges[j + 1] - edges[j])
+    out[row_start:row_start + rows, col_start:col_start + cols] = tile[:rows, :cols]
+    if symmetric and j != i:
+        out[col_start:col_start + cols, row_start:row_start + rows] = tile[:rows, :cols].T
+
+
+def _tile_blocks(edges, i, j, start_bin, symmetric):
+    # slices of a tile in the output matrix and of its mirrored block (None on the diagonal or when not mirrored)
+    rows = slice(edges[i] - start_bin, edges[i + 1] - start_bin)
+    cols = slice(edges[j] - start_bin, edges[j + 1] - start_bin)
+    return (rows, cols), ((cols, rows) if symmetric and j != i else None)
+
+
+def assemble_matrix(matrix_obj, start, end, resolution, tile_size=1400, out=None, symmetric=True, threads=1,
+                    opener=None, checkpoint=None):
+    # checkpoint: a TileCheckpoint whose matrix is out, its finished tiles are skipped and all tiles are verified
+    start_bin, end_bin = region_bins(start, end, resolution)
+    n_bins = end_bin - start_bin
+    if out is None:
+        out = alloc_matrix(n_bins)
+
+    edges = tile_edges(start_bin, end_bin, tile_size)
+    n_tiles = len(edges) - 1
+    # an intra-chromosomal map is symmetric, the lower triangle tiles are the transposed upper ones
+    tiles = [(i, j) for i in range(n_tiles) for j in range(i if symmetric else 0, n_tiles)]
+    logger.info(f"Extract {n_bins} bins in {len(tiles)} tiles of {tile_size} bins")
+
+    if threads > 1 and opener is None:
+        logger.warning("No way to open the Hi-C matrix in worker processes, fetch the tiles serially")
+        threads = 1
+
+    def place(i, j, tile):
+        if checkpoint is None:
+            _put_tile(out, tile, edges, i, j, start_bin, symmetric)
+            return
+        upper, lower = _tile_blocks(edges, i, j, start_bin, symmetric)
+        out[upper] = 0  # the tile may be partly written by a stopped run
+        if lower is not None:
+            out[lower] = 0
+        _put_tile(out, tile, edges, i, j, start_bin, symmetric)
+        checkpoint.record(i, j, block_crc(out[upper]))
+
+    def fetch(tiles):
+        # hicstraw includes the bin of the end coordinate
+        regions = [(edges[i] * resolution, (edges[i + 1] - 1) * resolution,
+                    edges[j] * resolution, (edges[j + 1] - 1) * resolution) for i, j in tiles]
+        if threads > 1 and len(tiles) > 1:
+            logger.info(f"Fetch the tiles with {threads} worker processes")
+            with ProcessPoolExecutor(max_workers=min(threads, len(tiles)), initializer=_init_worker,
+                                     initargs=(opener,)) as executor:
+                with profiler.span("fetch tiles", workers=threads):
+                    for (i, j), tile in zip(tiles, bounded_map(executor, _fetch_worker, regions, 2 * threads)):
+                        with profiler.span("place tile"):
+                            place(i, j, tile)
+        else:
+            for (i, j), region in zip(tiles, regions):
+                with profiler.span("fetch tile"):
+                    tile = matrix_obj.getRecordsAsMatrix(*region)
+                with profiler.span("place tile"):
+                    place(i, j, tile)
+
+    if checkpoint is None:
+        fetch(tiles)
+        return out
+
+    pending = [(i, j) for i, j in tiles if not checkpoint.is_done(i, j)]
+    if len(pending) < len(tiles):
+        logger.info(f"Skip {len(tiles) - len(pending)} tiles finished in the checkpoint, fetch {len(pending)}")
+    try:
+        fetch(pending)
+    finally:  # the tiles placed before an interruption (Ctrl-C, a failed worker) are kept for the next run
+        checkpoint.flush()
+
+    # every tile is checked against its CRC32 before the matrix is used, the failed ones are fetched once more
+    blocks = {(i, j): _tile_blocks(edges, i, j, start_bin, symmetric) for i, j in tiles}
+    with profiler.span("verify tiles"):
+        bad = checkpoint.verify(blocks)
+    if bad:
+        try:
+            fetch(bad)
+        finally:
+            checkpoint.flush()
+        with profiler.span("verify tiles"):
+            bad = checkpoint.verify({tile: blocks[tile] for tile in bad})
+        if bad:
+            raise RuntimeError(f"{len(bad)} tiles of the checkpoint {checkpoint.directory} failed the integrity "
+                               f"check again")
+    return out
+
+
+def group_sums(tile, row_groups, col_groups):
+    # sums of a tile over the runs of equal group ids of its rows and columns: (row ids, column ids, sums)
+    tile = tile[:len(row_groups), :len(col_groups)]
+    if tile.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 0))
+    row_groups, col_groups = row_groups[:tile.shape[0]], col_groups[:tile.shape[1]]
+    row_starts = np.flatnonzero(np.diff(row_groups, prepend=-2))
+    col_starts = np.flatnonzero(np.diff(col_groups, prepend=-2))
+    sums = np.add.reduceat(np.add.reduceat(tile, row_starts, axis=0, dtype=np.float64), col_starts, axis=1)
+    return row_groups[row_starts], col_groups[col_starts], sums
+
+
+def _summary_worker(task):
+    # fetch one tile and reduce it in the worker, only the group sums go back to the main process
+    region, (row_start, row_end), (col_start, col_end) = task
+    tile = _worker_matrix.getRecordsAsMatrix(*region)
+    return group_sums(tile, _worker_groups[row_start:row_end], _worker_groups[col_start:col_end])
+
+
+def summarize_matrix(matrix_obj, groups, n_groups, resolution, tile_size=1400, threads=1, opener=None):
+    # (n_groups, n_groups) contact sums of the symmetric matrix from bin 0, groups: group id of every bin (-1: none);
+    # every tile is reduced as soon as it is fetched, so no more than one tile per process is held in memory
+    out = np.zeros((n_groups, n_groups), dtype=np.float64)
+    edges = tile_edges(0, len(groups), tile_size)
+    n_tiles = len(edges) - 1
+    tiles = [(i, j) for i in range(n_tiles) for j in range(i, n_tiles)]
+    tasks = [((edges[i] * resolution, (edges[i + 1] - 1) * resolution,
+               edges[j] * resolution, (edges[j + 1] - 1) * resolution),
+              (edges[i], edges[i + 1]), (edges[j], edges[j + 1])) for i, j in tiles]
+    logger.info(f"Summarize {len(groups)} bins into {n_groups} groups from {len(tiles)} tiles of {tile_size} bins")
+
+    def add(i, j, result):
+        row_ids, col_ids, sums = result
+        rows, cols = row_ids >= 0, col_ids >= 0
+        row_ids, col_ids, sums = row_ids[rows], col_ids[cols], sums[np.ix_(rows, cols)]
+        out[np.ix_(row_ids, col_ids)] += sums
+        if i != j:  # the lower triangle tile is the transposed one
+            out[np.ix_(col_ids, row_ids)] += sums.T
+
+    if threads > 1 and opener is not None and len(tiles) > 1:
+        logger.info(f"Fetch and reduce the tiles with {threads} worker processes")
+        with ProcessPoolExecutor(max_workers=min(threads, len(tiles)), initializer=_init_worker,
+                                 initargs=(opener, groups)) as executor:
+            with profiler.span("fetch tiles", workers=threads):
+                for (i, j), result in zip(tiles, bounded_map(executor, _summary_worker, tasks, 2 * threads)):
+                    add(i, j, result)
+    else:
+        for (i, j), (region, (row_start, row_end), (col_start, col_end)) in zip(tiles, tasks):
+            with profiler.span("fetch tile"):
+                tile = matrix_obj.getRecordsAsMatrix(*region)
+            with profiler.span("reduce tile"):
+                add(i, j, group_sums(tile, groups[row_start:row_end], groups[col_start:col_end]))
+
+    return out
+
+
+def choose_resolution(hic_obj, resolution=None):
+    # the resolution to plot, a missing or unknown one falls back to the fourth finest of the file
+    resolutions = hic_obj.getResolutions()
+    logger.info(f"This Hi-C data has resolutions: {resolutions}")
+    if resolution is None:
+        resolution = resolutions[-4]
+        logger.info(f"Resolution not set, use the default max resolution: {resolution}")
+    elif resolution not in resolutions:
+        logger.error(f"Resolution {resolution} not in {resolutions}")
+        resolution = resolutions[-4]
+    logger.info(f"Use the resolution: {resolution}")
+    return resolution
+
+
+def read_chr_txt(chr_txt):
+    # chromosome text file: name, end loci in the hic file, index (the order key) per line
+    chr_info = {}  # chrom information
+    chr_start = 0  # chrom start loci
+    with open(chr_txt, 'r') as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            line = line.strip().split()
+            if not line:
+                continue
+            chr_info[line[2]] = {
+                "length": int(line[1]) - chr_start,  # chromosome length in hic file
+                "name": line[0],
+                "hic_loci": int(line[1])  # chromosome loci in hic file
+            }
+            chr_start = int(line[1])
+    return chr_info
+
+
+def load_hic(hic, resolution, matrix_end=None, data_type="observed", normalization="NONE", tile_size=1400,
+             threads=1, cache=None, checkpoint=None):
+    # the 'assembly' matrix up to matrix_end bp, through the matrix cache when one is given
+    def extract():
+        return parse_hic(hic, resolution, matrix_end=matrix_end, data_type=data_type, normalization=normalization,
+                         tile_size=tile_size, threads=threads, checkpoint=checkpoint), None
+
+    matrix, _ = cached_matrix(cache, [hic], {"source": "hic", "resolution": resolution, "data_type": data_type,
+                                             "normalization": normalization, "end": matrix_end}, extract)
+    return matrix
+
+
+def parse_hic(hic, resolution, matrix_end=None, data_type="observed", normalization="NONE", tile_size=1400,
+              memmap_file=None, threads=1, checkpoint=None):
+    # checkpoint: directory to persist the tiles in, a stopped extraction resumes from it (memmap_file is not used)
+    import hicstraw
 
-def parse_hic(hic, resolution, matrix_end=None, data_type="observed", normalization="NONE"):
     hic_obj = hicstraw.HiCFile(hic)
 
     chr_info = {chrom.name: chrom.length for chrom in hic_obj.getChromosomes()}
     hic_max_len = chr_info["assembly"]
     matrix_end = hic_max_len if matrix_end is None else matrix_end
 
-    res_max_len = resolution * 1400
-
     matrix_obj = hic_obj.getMatrixZoomData('assembly', 'assembly', data_type, normalization, "BP", resolution)
 
-    if res_max_len > matrix_end:
-        contact_matrix = matrix_obj.getRecordsAsMatrix(0, matrix_end, 0, matrix_end)
-    else:
-        extract_times = int(matrix_end / res_max_len) + 1  # extract times
-        iter_len = np.linspace(0, matrix_end, extract_times + 1)  # iteration length
-        incr_distance = iter_len[1]  # increment distance
-        final_matrix = None
-
-        for i in iter_len[1:]:
-            temp_matrix = None
-            for j in iter_len[1:]:
-                contact_matrix = matrix_obj.getRecordsAsMatrix(int(i - incr_distance), int(i), int(j - incr_distance),
-                                                               int(j))
-                temp_matrix = contact_matrix if temp_matrix is None else np.hstack((temp_matrix, contact_matrix))
-
-            final_matrix = temp_matrix if final_matrix is None else np.vstack((final_matrix, temp_matrix))
-
-        # Remove all zero rows and columns
-        final_matrix = final_matrix[~np.all(final_matrix == 0, axis=1)]
-        contact_matrix = final_matrix[:, ~np.all(final_matrix == 0, axis=0)]
+    start_bin, end_bin = region_bins(0, matrix_end, resolution)
+    opener = partial(open_matrix, hic, resolution, data_type, normalization)
+    if checkpoint:
+        stat = os.stat(hic)
+        tile_checkpoint = TileCheckpoint(checkpoint, end_bin - start_bin, {
+            "hic": [os.path.abspath(hic), stat.st_mtime_ns, stat.st_size], "resolution": resolution,
+            "data_type": data_type, "normalization": normalization, "end": matrix_end, "tile_size": tile_size})
+        assemble_matrix(matrix_obj, 0, matrix_end, resolution, tile_size=tile_size, out=tile_checkpoint.matrix,
+                        threads=threads, opener=opener, checkpoint=tile_checkpoint)
+        return tile_checkpoint.result()
+
+    contact_matrix = alloc_matrix(end_bin - start_bin, memmap_file=memmap_file)
+    assemble_matrix(matrix_obj, 0, matrix_end, resolution, tile_size=tile_size, out=contact_matrix, threads=threads,
+                    opener=opener)
+
+    return contact_matrix
+
+
+def parse_region(hic, start, end, resolution, chrom="assembly", data_type="observed", normalization="NONE",
+                 tile_size=1400, threads=1, memmap_file=None):
+    # contact matrix of the bins overlapping [start, end) bp of chrom
+    import hicstraw
+
+    hic_obj = hicstraw.HiCFile(hic)
+
+    chr_len = {chrom.name: chrom.length for chrom in hic_obj.getChromosomes()}
+    if chrom not in chr_len:
+        raise ValueError(f"Chromosome {chrom} not in the Hi-C file: {list(chr_len)}")
+    if end > chr_len[chrom]:
+        logger.warning(f"Region end {end} is beyond the length of {chrom}, use {chr_len[chrom]}")
+        end = chr_len[chrom]
+    if not 0 <= start < end:
+        raise ValueError(f"Invalid region: {chrom}:{start}-{end}")
+
+    start_bin, end_bin = region_bins(start, end, resolution)
+    logger.info(f"Extract {chrom}:{start}-{end}, bins {start_bin}-{end_bin} at resolution {resolution}")
+
+    matrix_obj = hic_obj.getMatrixZoomData(chrom, chrom, data_type, normalization, "BP", resolution)
+    contact_matrix = alloc_matrix(end_bin - start_bin, memmap_file=memmap_file)
+    assemble_matrix(matrix_obj, start, end, resolution, tile_size=tile_size, out=contact_matrix, threads=threads,
+                    opener=partial(open_matrix, hic, resolution, data_type, normalization, chrom))
 
     return contact_matrix
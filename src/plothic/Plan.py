@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Plan.py
+@Time: 2025/04/14 10:12
+@Function: Estimate the matrix size and memory of every resolution and choose the one to plot
+"""
+import os
+
+from .logger import logger
+
+# rough peak bytes per upper triangle record of a HiCPro matrix: text parsing (chunks, concatenation, mirrored COO,
+# CSR) and a store (memory-mapped records, mirrored CSR)
+RECORD_BYTES = {"text": 64, "store": 48}
+IMAGE_BYTES = 16  # per figure pixel: float64 pixel grid, float32 binned matrix and RGBA image
+
+
+def available_memory():
+    # bytes of memory a new process can use (MemAvailable on Linux, free pages elsewhere), None when unknown
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def estimate_hic(resolution, matrix_end, tile_size=1400, threads=1, n_pixels=3000):
+    # size of the dense 'assembly' matrix up to matrix_end bp at one resolution and the peak memory of plot_hic:
+    # the float32 matrix, the tiles being fetched (the records and the array of a tile, in every worker and in the
+    # main process) and the figure image
+    n_bins = max(1, -(-matrix_end // resolution))
+    n_tiles = -(-n_bins // tile_size)
+    tile = min(tile_size, n_bins) ** 2 * 4
+    fetching = max(1, threads) + (1 if threads > 1 else 0)
+    matrix = n_bins ** 2 * 4
+    return {"resolution": resolution, "bins": n_bins, "tiles": n_tiles * (n_tiles + 1) // 2, "matrix": matrix,
+            "peak": matrix + 2 * tile * fetching + min(n_bins, n_pixels) ** 2 * IMAGE_BYTES,
+            "bins_per_pixel": n_bins / n_pixels}
+
+
+def plan_hic(resolutions, matrix_end, tile_size=1400, threads=1, n_pixels=3000):
+    # estimates of all resolutions, from the finest
+    return [estimate_hic(resolution, matrix_end, tile_size=tile_size, threads=threads, n_pixels=n_pixels)
+            for resolution in sorted(resolutions)]
+
+
+def choose_plan(plans, max_memory=None, n_pixels=None):
+    # among the plans (finest first) within max_memory, the coarsest one with a bin for every figure pixel (a finer
+    # one draws the same figure from more data), or the finest one when none has enough bins or n_pixels is None;
+    # the coarsest plan when none fits
+    fits = [plan for plan in plans if max_memory is None or plan["peak"] <= max_memory]
+    if not fits:
+        logger.warning(f"No resolution fits in {format_bytes(max_memory)}, use the coarsest one")
+        return plans[-1]
+    if n_pixels is not None:
+        enough = [plan for plan in fits if plan["bins"] >= n_pixels]
+        if enough:
+            return enough[-1]
+    return fits[0]
+
+
+def format_bytes(size):
+    if size is None:
+        return "unknown"
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def print_plans(plans, chosen=None, max_memory=None):
+    # the plan table of a dry run, the chosen resolution marked with '*'
+    print(f"# memory budget: {format_bytes(max_memory)}")
+    print("resolution\tbins\ttiles\tmatrix\tpeak_memory\tbins_per_pixel\tfits")
+    for plan in plans:
+        mark = "*" if plan["resolution"] == chosen else ""
+        fits = "-" if max_memory is None or plan["peak"] is None else ("yes" if plan["peak"] <= max_memory else "no")
+        tiles = plan["tiles"] if plan["tiles"] is not None else "-"
+        print(f"{plan['resolution']}{mark}\t{plan['bins']}\t{tiles}\t{format_bytes(plan['matrix'])}\t"
+              f"{format_bytes(plan['peak'])}\t{plan['bins_per_pixel']:.2f}\t{fits}")
+
+
+def plan_resolution(hic_obj, matrix_end, resolution=None, max_memory=None, tile_size=1400, threads=1, n_pixels=3000,
+                    all_bins=False, dry_run=False):
+    # the resolution to plot the 'assembly' matrix of a .hic file: the given one, else by choose_plan among the
+    # resolutions within the memory budget (max_memory, default: the available memory) the coarsest one that still
+    # has a bin for every figure pixel, as a finer one draws the same figure from more data, or the finest one when
+    # none has that many bins (all_bins: no pixel limit, the finest one, e.g. for a pyramid); the plan of every
+    # resolution is printed for a dry run
+    from .ParseHiC import choose_resolution
+
+    plans = plan_hic(hic_obj.getResolutions(), matrix_end, tile_size=tile_size, threads=threads, n_pixels=n_pixels)
+    budget = max_memory if max_memory else available_memory()
+    if resolution is None:
+        plan = choose_plan(plans, budget, n_pixels=None if all_bins else n_pixels)
+        resolution = plan["resolution"]
+        logger.info(f"Resolution not set, plan the resolution {resolution}: {plan['bins']} bins, "
+                    f"peak memory {format_bytes(plan['peak'])} of {format_bytes(budget)}")
+    else:
+        resolution = choose_resolution(hic_obj, resolution)
+        plan = next(plan for plan in plans if plan["resolution"] == resolution)
+        if budget is not None and plan["peak"] > budget:
+            logger.warning(f"The resolution {resolution} needs about {format_bytes(plan['peak'])} of memory, "
+                           f"more than {format_bytes(budget)}")
+    if dry_run:
+        print_plans(plans, chosen=resolution, max_memory=budget)
+    return resolution
+
+
+def count_records(matrix_file, sample_lines=10000):
+    # upper triangle records of a store, or of a plain HiCPro matrix file by the mean length of its first lines;
+    # None for a compressed file
+    from .Store import is_store, read_store_meta
+
+    if is_store(matrix_file):
+        return read_store_meta(matrix_file)["n_records"]
+    if matrix_file.endswith(".gz"):
+        return None
+    n_lines = n_bytes = 0
+    with open(matrix_file, 'rb') as f:
+        for line in f:
+            n_lines += 1
+            n_bytes += len(line)
+            if n_lines >= sample_lines:
+                break
+    return round(os.path.getsize(matrix_file) * n_lines / n_bytes) if n_bytes else 0
+
+
+def plan_hicpro(matrix_file, abs_bed=None, n_pixels=3000, max_memory=None, dry_run=False):
+    # the single resolution of HiCPro data: bins from the abs bed file (or the store), memory of the sparse matrix
+    from .ParseBed import parse_abs_bed
+    from .Store import is_store, read_store_meta
+
+    if is_store(matrix_file):
+        chr_info = read_store_meta(matrix_file)["chromosomes"]
+        record_bytes = RECORD_BYTES["store"]
+    elif not abs_bed:
+        raise ValueError(f"{matrix_file} is not a store directory, please set the HiCPro abs bed file")
+    else:
+        chr_info = parse_abs_bed(abs_bed)
+        record_bytes = RECORD_BYTES["text"]
+    n_bins = max(chr_info[i]["index"] for i in chr_info)
+    n_records = count_records(matrix_file)
+    matrix = n_records * record_bytes if n_records is not None else None
+    plan = {"resolution": next(iter(chr_info.values()))["bin_size"], "bins": n_bins, "tiles": None,
+            "matrix": matrix, "peak": None if matrix is None else matrix + min(n_bins, n_pixels) ** 2 * IMAGE_BYTES,
+            "bins_per_pixel": n_bins / n_pixels}
+
+    budget = max_memory if max_memory else available_memory()
+    if budget is not None and plan["peak"] is not None and plan["peak"] > budget:
+        logger.warning(f"The matrix needs about {format_bytes(plan['peak'])} of memory, more than "
+                       f"{format_bytes(budget)}, convert it to a store (plothic convert) and plot it by chromosome")
+    if dry_run:
+        print_plans([plan], chosen=plan["resolution"], max_memory=budget)
+    return plan
@@ -10,47 +10,41 @@
 """
 import os
 
-import numpy as np
-
-from .PlotMTX import plot_matrix
+from .Normalize import normalize_matrix
+from .Plan import plan_hicpro
+from .PlotMTX import plot_matrices, plot_matrix
+from .Profile import profiler
+from .Pyramid import export_pyramid
+from .Reorder import reorder_matrix
+from .Store import iter_chrom_contacts, load_contacts
 from .logger import logger
 
 
 def plot_bed(matrix, abs_bed, order_bed="", output='./', genome_name="", fig_size=6, dpi=300,
              bar_min=0,
-             bar_max=None, cmap="YlOrRd", log=False, rotation=45, grid=True, out_format="pdf", xaxis=False):
+             bar_max=None, cmap="YlOrRd", log=False, rotation=45, grid=True, out_format="pdf", xaxis=False,
+             reducer="mean", cache=None, pyramid=None, balance=None, oe=False, vector_dpi=150, max_memory=None,
+             dry_run=False):
     logger.info(f"Start Plot Hi-C data (HiCPro format):")
     logger.info(f"HiCPro matrix file: {matrix}")
-    logger.info(f"HiCPro abs bed file: {abs_bed}")
-
-    # get the matrix data
-    data = np.loadtxt(matrix)
-
-    # convert bed to matrix
-    max_row = int(data[:, 0].max())
-    max_col = int(data[:, 1].max())
-
-    matrix = np.zeros((max_row, max_col))
-    for row, col, value in data:
-        matrix[int(row) - 1, int(col) - 1] = value
-        matrix[int(col) - 1, int(row) - 1] = value
-
-    chr_info = {}  # chromosome information
-    pre_label_loci = 0
-    with open(abs_bed, 'r') as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            line = line.strip().split()
-            chr_info[line[0]] = {
-                "length": int(line[2]),
-                "index": int(line[3])
-            }
+    if abs_bed:
+        logger.info(f"HiCPro abs bed file: {abs_bed}")
+
+    # the matrix size and memory of the single resolution of HiCPro data, for a dry run or a memory budget
+    if dry_run or max_memory:
+        plan_hicpro(matrix, abs_bed, n_pixels=int(fig_size * dpi), max_memory=max_memory, dry_run=dry_run)
+        if dry_run:
+            return
+
+    # get the matrix data (symmetric sparse matrix) and chromosome information, from text files or a store
+    with profiler.span("load"):
+        matrix, chr_info = load_contacts(matrix, abs_bed, cache=cache)
+    with profiler.span("normalize"):
+        matrix = normalize_matrix(matrix, balance=balance, oe=oe,
+                                  bounds=[(chr_info[i]["start"], chr_info[i]["index"]) for i in chr_info])
 
     chr_label_dict = {}  # chrom name: index in the matrix
     for i in chr_info:
-        chr_info[i]["loci"] = np.arange(pre_label_loci, chr_info[i]["index"])
-        pre_label_loci = chr_info[i]["index"]
         chr_label_dict[i] = chr_info[i]["index"]
 
     # sort the matrix by the order
@@ -58,7 +52,6 @@ def plot_bed(matrix, abs_bed, order_bed="", output='./', genome_name="", fig_siz
         logger.info(f"Order the matrix by the order file: {order_bed}")
 
         chr_order = {}  # chrom order: chromosome name
-        new_order = []  # new order of the matrix
         chr_label_dict = {}  # chrom name: index in the matrix
         with open(order_bed, 'r') as f:
             for line in f:
@@ -67,13 +60,22 @@ def plot_bed(matrix, abs_bed, order_bed="", output='./', genome_name="", fig_siz
                 line = line.strip().split()
                 chr_order[line[1]] = line[0]
         chr_order_len = len(chr_order)
+        chr_keys = list(chr_info)
+        bounds = [(chr_info[i]["start"], chr_info[i]["index"]) for i in chr_keys]
+        new_order = [chr_keys.index(chr_order[str(i)]) for i in range(1, chr_order_len + 1)]  # chromosome blocks
         pre_label = 0
         for i in range(1, chr_order_len + 1):
-            new_order.extend(chr_info[chr_order[str(i)]]["loci"])
-            chr_label_dict[chr_order[str(i)]] = len(chr_info[chr_order[str(i)]]["loci"]) + pre_label
+            chr_len = chr_info[chr_order[str(i)]]["index"] - chr_info[chr_order[str(i)]]["start"]
+            chr_label_dict[chr_order[str(i)]] = chr_len + pre_label
             pre_label = chr_label_dict[chr_order[str(i)]]
 
-        matrix = matrix[np.ix_(new_order, new_order)]
+        with profiler.span("reorder"):
+            matrix = reorder_matrix(matrix, bounds, new_order)
+
+    if pyramid:
+        with profiler.span("pyramid"):
+            export_pyramid(matrix, pyramid, next(iter(chr_info.values()))["bin_size"], labels=chr_label_dict)
+
     if os.path.isdir(output):  # output is a directory
         output = os.path.join(output, f"GenomeContact.{out_format}")
 
@@ -91,10 +93,13 @@ def plot_bed(matrix, abs_bed, order_bed="", output='./', genome_name="", fig_siz
     else:
         x_label_dict = None
 
-    plot_matrix(matrix, chr_info=chr_label_dict, outfile=output, genome_name=genome_name, fig_size=(fig_size, fig_size),
-                dpi=dpi,
-                bar_min=bar_min,
-                bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=grid, x_info=x_label_dict)
+    with profiler.span("plot", outfile=output):
+        plot_matrix(matrix, chr_info=chr_label_dict, outfile=output, genome_name=genome_name,
+                    fig_size=(fig_size, fig_size),
+                    dpi=dpi,
+                    bar_min=bar_min,
+                    bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=grid, x_info=x_label_dict,
+                    reducer=reducer, vector_dpi=vector_dpi)
 
     logger.info(f"Save the plot to {output}")
     logger.info("Finished Plot HiCPro data")
@@ -102,58 +107,38 @@ def plot_bed(matrix, abs_bed, order_bed="", output='./', genome_name="", fig_siz
 
 def plot_bed_split(matrix, abs_bed, output='./', fig_size=6, dpi=300,
                    bar_min=0,
-                   bar_max=None, cmap="YlOrRd", log=False, rotation=45, out_format="pdf", xaxis=False):
+                   bar_max=None, cmap="YlOrRd", log=False, rotation=45, out_format="pdf", xaxis=False,
+                   reducer="mean", cache=None, jobs=1, balance=None, oe=False, vector_dpi=150):
     logger.info(f"Start Plot Hi-C data (HiCPro format) with split chromosomes:")
     logger.info(f"HiCPro matrix file: {matrix}")
-    logger.info(f"HiCPro abs bed file: {abs_bed}")
-
-    # get the matrix data
-    data = np.loadtxt(matrix)
-
-    # convert the matrix data to a matrix
-    max_row = int(data[:, 0].max())
-    max_col = int(data[:, 1].max())
-
-    matrix = np.zeros((max_row, max_col))
-    for row, col, value in data:
-        matrix[int(row) - 1, int(col) - 1] = value
-        matrix[int(col) - 1, int(row) - 1] = value
-
-    chr_info = {}  # chrom information
-    with open(abs_bed, 'r') as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            line = line.strip().split()
-            chr_info[line[0]] = {
-                "length": int(line[2]),
-                "index": int(line[3])
-            }
-
-    pre_label_loci = 0
-    for i in chr_info:
-        chr_info[i]["loci"] = np.arange(pre_label_loci, chr_info[i]["index"])
-
-        chr_matrix = matrix[np.ix_(chr_info[i]["loci"], chr_info[i]["loci"])]
-        if os.path.isdir(output):  # output is a directory
-            chr_output = os.path.join(output, f"{i}.{out_format}")
-        else:
-            chr_output = os.path.join("./", f"{i}.{out_format}")
-
-        if xaxis:
-            logger.info("Show genome size at x-axis")
-            x_label_dict = {0: 0}
-            x_name=str(round(chr_info[i]["length"]/1000000, 1))+" Mb"
-            logger.info(f"Chromosome {i} length: {round(chr_info[i]['length']/1000000, 1)} Mb")
-            x_label_dict[x_name] = chr_matrix.shape[0]
-        else:
-            x_label_dict = None
-
-        plot_matrix(chr_matrix, chr_info=x_label_dict, outfile=chr_output, genome_name=i, fig_size=(fig_size, fig_size),
-                    dpi=dpi,
-                    bar_min=bar_min,
-                    bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=False)
-        pre_label_loci = chr_info[i]["index"]
-
-        logger.info(f"Save the plot to {chr_output}")
+    if abs_bed:
+        logger.info(f"HiCPro abs bed file: {abs_bed}")
+
+    def panels():
+        # the intra-chromosome matrices (symmetric sparse) one by one, from text files or a store
+        for i, chr_info, chr_matrix in iter_chrom_contacts(matrix, abs_bed, cache=cache):
+            with profiler.span("normalize", chrom=i):
+                chr_matrix = normalize_matrix(chr_matrix, balance=balance, oe=oe)
+            if os.path.isdir(output):  # output is a directory
+                chr_output = os.path.join(output, f"{i}.{out_format}")
+            else:
+                chr_output = os.path.join("./", f"{i}.{out_format}")
+
+            if xaxis:
+                logger.info("Show genome size at x-axis")
+                x_label_dict = {0: 0}
+                x_name=str(round(chr_info["length"]/1000000, 1))+" Mb"
+                logger.info(f"Chromosome {i} length: {round(chr_info['length']/1000000, 1)} Mb")
+                x_label_dict[x_name] = chr_matrix.shape[0]
+            else:
+                x_label_dict = None
+
+            yield chr_matrix, dict(chr_info=x_label_dict, outfile=chr_output, genome_name=i,
+                                   fig_size=(fig_size, fig_size),
+                                   dpi=dpi,
+                                   bar_min=bar_min,
+                                   bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=False, reducer=reducer,
+                                   vector_dpi=vector_dpi)
+
+    plot_matrices(panels(), workers=jobs)
     logger.info("Finished Plot HiCPro data with split chromosomes")
@@ -9,68 +9,70 @@
 @Function: Plot Whole genome Hi-C contact matrix heatmap
 """
 import os
+from functools import partial
 
 import hicstraw
 import numpy as np
 
-from .ParseHiC import parse_hic
-from .PlotMTX import plot_matrix
+from .Cache import cached_matrix
+from .Normalize import normalize_matrix
+from .ParseAsy import assembly_chr_info
+from .ParseHiC import (choose_resolution, load_hic, open_matrix, parse_region, read_chr_txt, region_bins,
+                       summarize_matrix)
+from .Plan import plan_resolution
+from .PlotMTX import plot_matrices, plot_matrix
+from .Profile import profiler
+from .Pyramid import export_pyramid
+from .Reorder import BlockReorder
 from .logger import logger
 
 
-def plot_hic(hic, chr_txt, output='./', resolution=None, data_type="observed",
+def plot_hic(hic, chr_txt=None, output='./', resolution=None, data_type="observed",
              normalization="NONE", genome_name="", fig_size=6, dpi=300,
              bar_min=0,
              bar_max=None, cmap="YlOrRd", order=False, log=False, rotation=45, grid=True, out_format="pdf",
-             xaxis=False):
+             xaxis=False, reducer="mean", tile_size=1400, threads=1, cache=None, pyramid=None, balance=None,
+             oe=False, assembly=None, asy_chr_num=None, vector_dpi=150, max_memory=None, dry_run=False,
+             checkpoint=None):
     logger.info(f"Start Plot Hi-C data (hic format): {hic}")
 
     # get hic object
     hic_obj = hicstraw.HiCFile(hic)
 
-    # get resolutions
-    resolutions = hic_obj.getResolutions()
-    logger.info(f"This Hi-C data has resolutions: {resolutions}")
-
-    # choose resolution
-    if resolution is None:
-        resolution = resolutions[-4]
-        logger.info(f"Resolution not set, use the default max resolution: {resolution}")
-    elif resolution not in resolutions:
-        logger.error(f"Resolution {resolution} not in {resolutions}")
-        resolution = resolutions[-4]
-    logger.info(f"Use the resolution: {resolution}")
-    if resolution <= 1000:
-        logger.warning("The resolution is too small, the memory usage will be large")
-    logger.info(f"Use the {data_type} data type and {normalization} normalization method")
-
-    chr_info = {}  # chrom information
-    chr_start = 0  # chrom start loci
-    last_chr_len = 0  # last chrom len
-
-    # get chromosome information
-    with (open(chr_txt, 'r') as f):
-        for line in f:
-            if line.startswith("#"):
-                continue
-            line = line.strip().split()
-            chr_info[line[2]] = {
-                "length": int(line[1]) - chr_start,  # chromosome length in hic file
-                "name": line[0],
-                "hic_loci": int(line[1])  # chromosome loci in hic file
-            }
-            chr_start = int(line[1])
-
-            # get the last chromosome length
-            if int(line[1]) > last_chr_len:
-                last_chr_len = int(line[1])
+    # get chromosome information, from the .assembly file or the chromosome text file
+    if assembly:
+        logger.info(f"Use the chromosomes of the assembly file: {assembly}")
+        chr_info = assembly_chr_info(hic_obj, hic, assembly, asy_chr_num=asy_chr_num)
+    else:
+        chr_info = read_chr_txt(chr_txt)
+    last_chr_len = max(chr_info[i]["hic_loci"] for i in chr_info)  # last chrom len
 
     logger.info(f"Chromosome information: {chr_info}")
 
-    matrix = parse_hic(hic, resolution, matrix_end=last_chr_len, data_type=data_type,
-                       normalization=normalization).astype(np.float32)
+    # the resolution from the matrix size and memory of every resolution, the pixels of the figure as the limit
+    resolution = plan_resolution(hic_obj, last_chr_len, resolution=resolution, max_memory=max_memory,
+                                 tile_size=tile_size, threads=threads, n_pixels=int(fig_size * dpi),
+                                 all_bins=bool(pyramid), dry_run=dry_run)
+    if dry_run:
+        return
+    logger.info(f"Use the {data_type} data type and {normalization} normalization method")
+
+    with profiler.span("extract"):
+        matrix = load_hic(hic, resolution, matrix_end=last_chr_len, data_type=data_type,
+                          normalization=normalization, tile_size=tile_size, threads=threads, cache=cache,
+                          checkpoint=checkpoint)
     matrix_len = len(matrix)
 
+    if balance or oe:
+        chr_bounds = []  # (start, end) bins of each chromosome
+        pre_index = 0
+        for i in chr_info:
+            index = chr_info[i]["hic_loci"] * matrix_len // last_chr_len
+            chr_bounds.append((pre_index, index))
+            pre_index = index
+        with profiler.span("normalize"):
+            matrix = normalize_matrix(matrix, balance=balance, oe=oe, bounds=chr_bounds, inplace=True)
+
     chr_label_dict = {}  # chr name: loci index in matrix
     for i in chr_info:
         chr_label_dict[chr_info[i]["name"]] = chr_info[i]["hic_loci"] * matrix_len // last_chr_len
@@ -86,21 +88,26 @@ def plot_hic(hic, chr_txt, output='./', resolution=None, data_type="observed",
             chr_info[i]["index"] = (chr_info[i]["hic_loci"] * matrix_len) // last_chr_len
             pre_index = chr_info[i]["index"]
 
-        new_order = []
+        chr_keys = list(chr_info)
+        bounds = [(chr_info[i]["pre_index"], chr_info[i]["index"]) for i in chr_keys]
+        new_order = [chr_keys.index(str(i)) for i in range(1, chr_dict_length + 1)]
 
         pre_label_loci = 0
         for i in range(1, chr_dict_length + 1):
-            temp_order = np.arange(chr_info[str(i)]["pre_index"], chr_info[str(i)]["index"])
-            new_order.extend(temp_order)
-            chr_info[str(i)]["label_loci"] = len(temp_order) + pre_label_loci
+            chr_info[str(i)]["label_loci"] = chr_info[str(i)]["index"] - chr_info[str(i)]["pre_index"] + pre_label_loci
             pre_label_loci = chr_info[str(i)]["label_loci"]
 
-        # get the new order matrix
-        matrix = matrix[new_order, :][:, new_order]
+        # get the new order matrix, the chromosome blocks are only moved when binned for the figure
+        with profiler.span("reorder"):
+            matrix = BlockReorder(matrix, bounds, new_order)
 
         chr_label_dict = {}
         for i in chr_info:
             chr_label_dict[chr_info[i]["name"]] = chr_info[i]["label_loci"]
+    if pyramid:
+        with profiler.span("pyramid"):
+            export_pyramid(matrix, pyramid, resolution, labels=chr_label_dict)
+
     if os.path.isdir(output):  # output is a directory
         output = os.path.join(output, f"GenomeContact.{out_format}")
 
@@ -115,10 +122,13 @@ def plot_hic(hic, chr_txt, output='./', resolution=None, data_type="observed",
             x_label_dict[x_name] = chr_label_dict[i]
     else:
         x_label_dict = None
-    plot_matrix(matrix, chr_info=chr_label_dict, outfile=output, genome_name=genome_name, fig_size=(fig_size, fig_size),
-                dpi=dpi,
-                bar_min=bar_min,
-                bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=grid, x_info=x_label_dict)
+    with profiler.span("plot", outfile=output):
+        plot_matrix(matrix, chr_info=chr_label_dict, outfile=output, genome_name=genome_name,
+                    fig_size=(fig_size, fig_size),
+                    dpi=dpi,
+                    bar_min=bar_min,
+                    bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=grid, x_info=x_label_dict,
+                    reducer=reducer, vector_dpi=vector_dpi)
 
     logger.info(f"Save the plot to {output}")
     logger.info("Finished Plot Hi-C data")
@@ -127,88 +137,142 @@ def plot_hic(hic, chr_txt, output='./', resolution=None, data_type="observed",
 def plot_hic_split(hic, split_txt, output='./', resolution=None, data_type="observed",
                    normalization="NONE", genome_name="", fig_size=6, dpi=300,
                    bar_min=0,
-                   bar_max=None, cmap="YlOrRd", log=False, rotation=45, out_format="pdf", xaxis=False):
+                   bar_max=None, cmap="YlOrRd", log=False, rotation=45, out_format="pdf", xaxis=False,
+                   reducer="mean", tile_size=1400, threads=1, cache=None, jobs=1, balance=None, oe=False,
+                   vector_dpi=150):
     logger.info(f"Start Plot Hi-C data (hic format) with split chromosome: {hic}")
 
     # get hic object
     hic_obj = hicstraw.HiCFile(hic)
-
-    # get resolutions
-    resolutions = hic_obj.getResolutions()
-    logger.info(f"This Hi-C data has resolutions: {resolutions}")
-
-    # choose resolution
-    if resolution is None:
-        resolution = resolutions[-4]
-        logger.info(f"Resolution not set, use the default max resolution: {resolution}")
-    elif resolution not in resolutions:
-        logger.error(f"Resolution {resolution} not in {resolutions}")
-        resolution = resolutions[-4]
-    logger.info(f"Use the resolution: {resolution}")
+    resolution = choose_resolution(hic_obj, resolution)
     logger.info(f"Use the {data_type} data type and {normalization} normalization method")
 
+    # chromosomes of the hic file, a name of the split file matching one of them is read from its own matrix
+    # (intra-chromosome records only), other regions from the 'assembly' pseudo-chromosome
+    hic_chroms = {chrom.name: chrom.length for chrom in hic_obj.getChromosomes()
+                  if chrom.name not in ("All", "ALL", "assembly")}
+
     chr_info = {}  # chromosome information
     with (open(split_txt, 'r') as f):
         for line in f:
             if line.startswith("#"):
                 continue
             line = line.strip().split()
+            if not line:
+                continue
+            if len(line) == 1:  # a chromosome name of the hic file, the whole chromosome
+                if line[0] not in hic_chroms:
+                    raise ValueError(f"Chromosome {line[0]} not in the Hi-C file: {list(hic_chroms)}")
+                line += [0, hic_chroms[line[0]]]
             chr_info[line[0]] = {
+                "chrom": line[0] if line[0] in hic_chroms else "assembly",
                 "start": int(line[1]),
                 "end": int(line[2])
             }
 
     logger.info(f"Chromosome information: {chr_info}")
-    res_max_len = resolution * 1400
-    matrix_obj = hic_obj.getMatrixZoomData('assembly', 'assembly', data_type, normalization, "BP", resolution)
-
-    for k in chr_info:
-        chr_name = k
-        loci_len = chr_info[k]["end"] - chr_info[k]["start"]
-
-        if res_max_len > loci_len:
-            contact_matrix = matrix_obj.getRecordsAsMatrix(chr_info[k]["start"], chr_info[k]["end"],
-                                                           chr_info[k]["start"], chr_info[k]["end"])
-        else:
-            extract_times = int(loci_len / res_max_len) + 1  # extract times
-            iter_len = np.linspace(chr_info[k]["start"], loci_len, extract_times + 1)  # iteration length
-            incr_distance = iter_len[1]  # increment distance
-            final_matrix = None
-
-            for i in iter_len[1:]:
-                temp_matrix = None
-                for j in iter_len[1:]:
-                    contact_matrix = matrix_obj.getRecordsAsMatrix(int(i - incr_distance), int(i),
-                                                                   int(j - incr_distance),
-                                                                   int(j))
-                    temp_matrix = contact_matrix if temp_matrix is None else np.hstack((temp_matrix, contact_matrix))
-
-                final_matrix = temp_matrix if final_matrix is None else np.vstack((final_matrix, temp_matrix))
-
-            # Remove all zero rows and columns
-            non_zero_rows = final_matrix[~np.all(final_matrix == 0, axis=1)]
-            contact_matrix = non_zero_rows[:, ~np.all(non_zero_rows == 0, axis=0)]
-
-        if os.path.isdir(output):  # output is a directory
-            chr_output = os.path.join(output, f"{chr_name}.{out_format}")
-        else:
-            chr_output = os.path.join("./", f"{chr_name}.{out_format}")
-
-        if xaxis:
-            logger.info("Show genome size at x-axis")
-            x_label_dict = {0: 0}
-            x_name = str(round(loci_len / 1000000, 1)) + " Mb"
-            logger.info(f"Chromosome length: {x_name}")
-            x_label_dict[x_name] = contact_matrix.shape[0]
-        else:
-            x_label_dict = None
-
-        plot_matrix(contact_matrix, chr_info=x_label_dict, outfile=chr_output, genome_name=genome_name + chr_name,
-                    fig_size=(fig_size, fig_size),
-                    dpi=dpi,
-                    bar_min=bar_min,
-                    bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=False)
 
-        logger.info(f"Save the plot to {chr_output}")
+    def panels():
+        for k in chr_info:
+            chr_name = k
+            loci_len = chr_info[k]["end"] - chr_info[k]["start"]
+
+            def extract():
+                return parse_region(hic, chr_info[k]["start"], chr_info[k]["end"], resolution,
+                                    chrom=chr_info[k]["chrom"], data_type=data_type, normalization=normalization,
+                                    tile_size=tile_size, threads=threads), None
+
+            region_params = {"source": "hic", "resolution": resolution, "data_type": data_type,
+                             "normalization": normalization, "start": chr_info[k]["start"], "end": chr_info[k]["end"]}
+            if chr_info[k]["chrom"] != "assembly":
+                region_params["chrom"] = chr_info[k]["chrom"]
+            with profiler.span("extract", chrom=chr_name):
+                contact_matrix, _ = cached_matrix(cache, [hic], region_params, extract)
+            with profiler.span("normalize", chrom=chr_name):
+                contact_matrix = normalize_matrix(contact_matrix, balance=balance, oe=oe, inplace=True)
+
+            if os.path.isdir(output):  # output is a directory
+                chr_output = os.path.join(output, f"{chr_name}.{out_format}")
+            else:
+                chr_output = os.path.join("./", f"{chr_name}.{out_format}")
+
+            if xaxis:
+                logger.info("Show genome size at x-axis")
+                x_label_dict = {0: 0}
+                x_name = str(round(loci_len / 1000000, 1)) + " Mb"
+                logger.info(f"Chromosome length: {x_name}")
+                x_label_dict[x_name] = contact_matrix.shape[0]
+            else:
+                x_label_dict = None
+
+            yield contact_matrix, dict(chr_info=x_label_dict, outfile=chr_output, genome_name=genome_name + chr_name,
+                                       fig_size=(fig_size, fig_size),
+                                       dpi=dpi,
+                                       bar_min=bar_min,
+                                       bar_max=bar_max, cmap=cmap, log=log, rotation=rotation, grid=False,
+                                       reducer=reducer, vector_dpi=vector_dpi)
+
+    plot_matrices(panels(), workers=jobs)
 
     logger.info("Finished Plot Hi-C data with split chromosome")
+
+
+def plot_hic_summary(hic, chr_txt=None, output='./', resolution=None, data_type="observed", normalization="NONE",
+                     genome_name="", fig_size=6, dpi=300, bar_min=0, bar_max=None, cmap="YlOrRd", log=False,
+                     rotation=45, out_format="pdf", tile_size=1400, threads=1, assembly=None, asy_chr_num=None,
+                     summary_bin=0, vector_dpi=150):
+    # contact sums between the chromosomes (or between summary_bin bp bins of every chromosome) of the 'assembly'
+    # matrix, reduced tile by tile while fetching; written as a bedpe-like TSV and a heatmap of contacts per bin pair
+    logger.info(f"Start the contact summary of the Hi-C data: {hic}")
+    hic_obj = hicstraw.HiCFile(hic)
+    resolution = choose_resolution(hic_obj, resolution)
+    logger.info(f"Use the {data_type} data type and {normalization} normalization method")
+
+    if assembly:
+        logger.info(f"Use the chromosomes of the assembly file: {assembly}")
+        chr_info = assembly_chr_info(hic_obj, hic, assembly, asy_chr_num=asy_chr_num)
+    else:
+        chr_info = read_chr_txt(chr_txt)
+    last_chr_len = max(chr_info[i]["hic_loci"] for i in chr_info)
+
+    # group id of every bin, and the (name, start, end) of every group in chromosome coordinates
+    n_bins = region_bins(0, last_chr_len, resolution)[1]
+    groups = np.full(n_bins, -1, dtype=np.int32)
+    records = []
+    chr_label_dict = {}  # chr name: index of its last group + 1
+    start_bin = 0
+    for i in chr_info:
+        end_bin = chr_info[i]["hic_loci"] * n_bins // last_chr_len
+        step = max(1, summary_bin // resolution) if summary_bin else max(1, end_bin - start_bin)
+        for group_start in range(start_bin, end_bin, step):
+            group_end = min(group_start + step, end_bin)
+            groups[group_start:group_end] = len(records)
+            records.append((chr_info[i]["name"], (group_start - start_bin) * resolution,
+                            min((group_end - start_bin) * resolution, chr_info[i]["length"]), group_end - group_start))
+        chr_label_dict[chr_info[i]["name"]] = len(records)
+        start_bin = end_bin
+
+    with profiler.span("summarize"):
+        contacts = summarize_matrix(open_matrix(hic, resolution, data_type, normalization), groups, len(records),
+                                    resolution, tile_size=tile_size, threads=threads,
+                                    opener=partial(open_matrix, hic, resolution, data_type, normalization))
+    group_bins = np.array([record[3] for record in records], dtype=np.float64)
+    density = (contacts / np.outer(group_bins, group_bins)).astype(np.float32)  # contacts per bin pair
+
+    if os.path.isdir(output):  # output is a directory
+        output = os.path.join(output, f"GenomeSummary.{out_format}")
+    summary_file = os.path.splitext(output)[0] + ".tsv"
+    with open(summary_file, 'w') as f:
+        f.write("#chrom1\tstart1\tend1\tchrom2\tstart2\tend2\tcontacts\tcontacts_per_bin_pair\n")
+        for a in range(len(records)):
+            for b in range(a, len(records)):
+                f.write(f"{records[a][0]}\t{records[a][1]}\t{records[a][2]}\t{records[b][0]}\t{records[b][1]}\t"
+                        f"{records[b][2]}\t{contacts[a, b]:.6g}\t{density[a, b]:.6g}\n")
+    logger.info(f"Save the contact summary to {summary_file}")
+
+    with profiler.span("plot", outfile=output):
+        plot_matrix(density, chr_info=chr_label_dict, outfile=output, genome_name=genome_name,
+                    fig_size=(fig_size, fig_size), dpi=dpi, bar_min=bar_min, bar_max=bar_max, cmap=cmap, log=log,
+                    rotation=rotation, vector_dpi=vector_dpi)
+    logger.info(f"Save the plot to {output}")
+    logger.info("Finished the contact summary of the Hi-C data")
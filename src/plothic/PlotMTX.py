@@ -8,11 +8,22 @@
 @Time: 2024/11/12 15:47
 @Function: Plot Whole genome Hi-C contact matrix heatmap
 """
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as plt
-import numpy as np
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from numpy import log2
 
+from .BinMTX import bin_matrix, scale_labels
+from .Cache import load_matrix, save_matrix
+from .ColorScale import approx_percentile, log_transform
+from .Profile import profiler
+from .Raster import RASTER_FORMATS, colorize, draw_heatmap, output_format, save_canvas
 from .logger import logger
 
 
@@ -25,67 +36,152 @@ def plot_matrix(matrix, chr_info=None, genome_name="Genome", outfile='GenomeCont
                 axes_pad=6, grid=True,
                 grid_style='dashed', grid_color='black', grid_width=1, grip_alpha=0.8, bar_size="3%", bar_pad=0.1,
                 font_size=10,
-                log=False, rotation=45, x_info=None):
-    fig, ax = plt.subplots(1, 1, figsize=fig_size, dpi=dpi)
-
-    if chr_info is None:
-        labels = []
-        pos = []
-    else:
-        labels = list(chr_info.keys())  # chrom names
-        pos = list(chr_info.values())  # chrom loci
-
-    ax.set_xticks(pos)
-    ax.set_yticks(pos)
-
-    ax.set_xticklabels(labels)
-    ax.set_yticklabels(labels)
-
-    if x_info is not None:
-        x_labels = list(x_info.keys())  # chrom names
-        x_pos = list(x_info.values())  # chrom loci
-
-        ax.set_xticks(x_pos)
-        ax.set_xticklabels(x_labels)
-
-    # set genome title
-    if genome_name == "":
-        logger.warning("Genome name is not set")
-    else:
-        logger.info(f"Genome name: {genome_name}")
-    ax.set_title(genome_name, fontsize=20, pad=8, fontstyle='italic')
+                log=False, rotation=45, x_info=None, max_pixels=None, reducer="mean", vector_dpi=150, engine="raster"):
+    # engine "raster": the heatmap is colored to an RGBA image by a lookup table; raster formats are written from
+    # the pixel buffer by PIL, vector formats embed the image binned to fig_size * vector_dpi pixels (0: not binned)
+    # and keep only the axes, labels and color bar as vectors. "matplotlib": imshow of the values and savefig
+    # a ContactMatrix brings its chromosome labels and log flag, its transforms are evaluated here
+    if hasattr(matrix, "evaluate"):
+        chr_info = matrix.labels() if chr_info is None else chr_info
+        log = log or matrix.log_scale
+        matrix = matrix.evaluate()
+
+    # bin the matrix to the pixel grid of the figure, more bins than pixels can not be shown
+    if max_pixels is None:
+        max_pixels = int(max(fig_size) * dpi)
+    matrix_bins = matrix.shape[0]
+    source = matrix
+    with profiler.span("bin"):
+        matrix, factor = bin_matrix(matrix, max_pixels, reducer=reducer)
+    owned = matrix is not source  # the binned (or densified) matrix is a new buffer that can be changed in place
+    if factor > 1:
+        logger.info(f"Bin the {matrix_bins} x {matrix_bins} matrix to {len(matrix)} x {len(matrix)} pixels "
+                    f"({reducer} of {factor} x {factor} bins)")
+        chr_info = scale_labels(chr_info, factor)
+        x_info = scale_labels(x_info, factor)
 
-    if grid:
-        logger.info("Show grid in the heatmap")
-        ax.grid(color=grid_color, linestyle=grid_style, linewidth=grid_width, alpha=grip_alpha)
-
-    plt.setp(ax.get_xticklabels(), rotation=rotation, ha="right", rotation_mode="anchor", fontsize=font_size)
-    plt.setp(ax.get_yticklabels(), rotation=rotation, ha="right", rotation_mode="anchor", fontsize=font_size)
-
-    ax.tick_params(direction='out', length=axes_len, width=axes_wd, pad=axes_pad)
-
-    color_bar = make_axes_locatable(ax)
-    cax = color_bar.append_axes("right", size=bar_size, pad=bar_pad)
-
-    matrix_len = len(matrix)  # matrix length
-    lim_extents = matrix_len + 0.5
-    ax.set_ylim(0.5, lim_extents)
-    ax.set_xlim(0.5, lim_extents)
-
-    matrix = matrix + 1e-9  # avoid log2(0) error
-    maxcolor = (np.percentile(matrix, 90))
     if bar_max is None:
-        bar_max = maxcolor
+        # streamed histogram estimate of the 90th percentile, no sorted copy of the matrix
+        with profiler.span("color scale"):
+            bar_max = approx_percentile(matrix, 90)
         logger.info(f"Max color is not set, use the default max color: {bar_max}")
     logger.info(f"Color bar range: {bar_min} - {bar_max}")
     logger.info(f"Use the color map: {cmap}")
-    with np.errstate(divide='ignore'):
-        img = ax.imshow(log2(matrix) if log else matrix, cmap=plt.get_cmap(cmap), vmin=bar_min, vmax=bar_max,
-                        origin="lower",
-                        interpolation="nearest",
-                        extent=(0.5, lim_extents, 0.5, lim_extents), aspect='auto')
-
-    cb = fig.colorbar(img, ax=ax, cax=cax, orientation="vertical")
-    cb.ax.tick_params(labelsize=font_size)
 
-    plt.savefig(outfile)
+    raster = engine == "raster"
+    out_format = output_format(outfile)
+    matrix_len = len(matrix)  # matrix length, the axes are in bins of the binned matrix
+    image_factor = 1  # matrix bins per image pixel
+    if raster and out_format not in RASTER_FORMATS and vector_dpi:
+        with profiler.span("bin", image="vector"):
+            image, image_factor = bin_matrix(matrix, int(max(fig_size) * vector_dpi), reducer=reducer)
+        if image_factor > 1:
+            logger.info(f"Embed the heatmap as a {len(image)} x {len(image)} image in the {out_format} figure")
+            matrix, owned = image, True
+
+    if log:
+        with profiler.span("log"):
+            matrix = log_transform(matrix, inplace=owned)  # log2(matrix + 1e-9), avoid log2(0) error
+
+    if raster:
+        with profiler.span("colorize"):
+            rgba = colorize(matrix, plt.get_cmap(cmap), bar_min, bar_max)
+
+    with profiler.span("render"):
+        fig, ax = plt.subplots(1, 1, figsize=fig_size, dpi=dpi)
+
+        if chr_info is None:
+            labels = []
+            pos = []
+        else:
+            labels = list(chr_info.keys())  # chrom names
+            pos = list(chr_info.values())  # chrom loci
+
+        ax.set_xticks(pos)
+        ax.set_yticks(pos)
+
+        ax.set_xticklabels(labels)
+        ax.set_yticklabels(labels)
+
+        if x_info is not None:
+            x_labels = list(x_info.keys())  # chrom names
+            x_pos = list(x_info.values())  # chrom loci
+
+            ax.set_xticks(x_pos)
+            ax.set_xticklabels(x_labels)
+
+        # set genome title
+        if genome_name == "":
+            logger.warning("Genome name is not set")
+        else:
+            logger.info(f"Genome name: {genome_name}")
+        ax.set_title(genome_name, fontsize=20, pad=8, fontstyle='italic')
+
+        if grid:
+            logger.info("Show grid in the heatmap")
+            ax.grid(color=grid_color, linestyle=grid_style, linewidth=grid_width, alpha=grip_alpha)
+
+        plt.setp(ax.get_xticklabels(), rotation=rotation, ha="right", rotation_mode="anchor", fontsize=font_size)
+        plt.setp(ax.get_yticklabels(), rotation=rotation, ha="right", rotation_mode="anchor", fontsize=font_size)
+
+        ax.tick_params(direction='out', length=axes_len, width=axes_wd, pad=axes_pad)
+
+        color_bar = make_axes_locatable(ax)
+        cax = color_bar.append_axes("right", size=bar_size, pad=bar_pad)
+
+        lim_extents = matrix_len + 0.5
+        ax.set_ylim(0.5, lim_extents)
+        ax.set_xlim(0.5, lim_extents)
+
+        if raster:
+            # the last image pixel may cover less than image_factor bins, the part beyond the axes is clipped
+            draw_heatmap(ax, rgba, len(rgba) * image_factor + 0.5, out_format)
+            img = ScalarMappable(norm=Normalize(vmin=bar_min, vmax=bar_max), cmap=plt.get_cmap(cmap))
+        else:
+            img = ax.imshow(matrix, cmap=plt.get_cmap(cmap), vmin=bar_min, vmax=bar_max,
+                            origin="lower",
+                            interpolation="nearest",
+                            extent=(0.5, lim_extents, 0.5, lim_extents), aspect='auto')
+
+        cb = fig.colorbar(img, ax=ax, cax=cax, orientation="vertical")
+        cb.ax.tick_params(labelsize=font_size)
+
+    with profiler.span("save"):
+        if not (raster and out_format in RASTER_FORMATS and save_canvas(fig, outfile, dpi)):
+            fig.savefig(outfile)
+    plt.close(fig)
+
+
+def _plot_matrix_file(matrix_dir, meta, kwargs):
+    plot_matrix(load_matrix(matrix_dir, meta), **kwargs)
+    return kwargs["outfile"]
+
+
+def plot_matrices(panels, workers=1):
+    # panels yields (matrix, plot_matrix arguments), e.g. one panel per chromosome
+    if workers <= 1:
+        for matrix, kwargs in panels:
+            with profiler.span("plot", outfile=kwargs["outfile"]):
+                plot_matrix(matrix, **kwargs)
+            logger.info(f"Save the plot to {kwargs['outfile']}")
+        return
+
+    # every worker memory-maps only its own sub-matrix from the temporary directory; at most 2 x workers panels
+    # are extracted and not yet rendered, so the temporary files and the memory do not grow with the panel count
+    logger.info(f"Render the figures with {workers} worker processes")
+
+    def finish(matrix_dir, future):
+        logger.info(f"Save the plot to {future.result()}")
+        shutil.rmtree(matrix_dir, ignore_errors=True)
+
+    with tempfile.TemporaryDirectory(prefix="plothic_") as temp_dir, ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for k, (matrix, kwargs) in enumerate(panels):
+            matrix_dir = os.path.join(temp_dir, str(k))
+            meta = save_matrix(matrix_dir, matrix)
+            del matrix
+            pending.append((matrix_dir, executor.submit(_plot_matrix_file, matrix_dir, meta, kwargs)))
+            if len(pending) >= 2 * workers:  # wait for the oldest panel before the next one is extracted
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Profile.py
+@Time: 2025/03/24 14:15
+@Function: Opt-in wall-clock, CPU and memory spans of the pipeline stages
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .logger import logger
+
+
+def _cpu_time():
+    # CPU seconds of this process and of its finished worker processes
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+
+class Profiler:
+    # spans are only recorded when enabled, otherwise span() costs one attribute check; the memory of a span is the
+    # peak RSS of the process, the peak of the Python allocations is traced only on request (trace_memory) as
+    # tracemalloc slows every allocation down, imports included, several times, and so the wall and CPU times
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.spans = []
+        self._open = []  # stack of [name path, peak traced bytes] of the running spans
+        self._origin = 0.0
+
+    def enable(self, trace_memory=False):
+        # start a new profile, e.g. for the next job of a batch worker
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.spans = []
+        self._open = []
+        self._origin = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _fold_peak(self):
+        # the traced peak since the last reset belongs to every running span, then measure the next interval
+        if not self.trace_memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self._open:
+            frame[1] = max(frame[1], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+
+        self._fold_peak()
+        path = f"{self._open[-1][0]} > {name}" if self._open else name
+        frame = [path, tracemalloc.get_traced_memory()[0] if self.trace_memory else None]
+        self._open.append(frame)
+        start_wall, start_cpu = time.perf_counter(), _cpu_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - start_wall, _cpu_time() - start_cpu
+            self._fold_peak()
+            self._open.pop()
+            self.spans.append({"name": name, "path": path, "depth": len(self._open),
+                               "start": start_wall - self._origin, "wall": wall, "cpu": cpu,
+                               "peak_mb": frame[1] / 1024 ** 2 if self.trace_memory else None,
+                               "peak_rss_mb": _peak_rss_mb(), "args": args})
+
+    def summary(self):
+        # spans with the same path are added up, in the order they were first entered
+        totals = {}
+        for span in sorted(self.spans, key=lambda item: item["start"]):
+            total = totals.setdefault(span["path"], {"name": span["name"], "depth": span["depth"], "count": 0,
+                                                     "wall": 0.0, "cpu": 0.0, "peak_mb": 0.0})
+            total["count"] += 1
+            total["wall"] += span["wall"]
+            total["cpu"] += span["cpu"]
+            # traced peak of the Python allocations, or the peak RSS of the process so far
+            peak = span["peak_mb"] if self.trace_memory else span["peak_rss_mb"]
+            total["peak_mb"] = max(total["peak_mb"], peak or 0.0)
+
+        memory = "peak traced MB" if self.trace_memory else "peak RSS MB"
+        logger.info(f"Profile (wall s, CPU s, {memory}, calls):")
+        for total in totals.values():
+            logger.info(f"{'  ' * total['depth']}{total['name']}: {total['wall']:.3f} s, {total['cpu']:.3f} s, "
+                        f"{total['peak_mb']:.1f} MB, {total['count']}")
+        return totals
+
+    def write_json(self, outfile):
+        with open(outfile, 'w') as f:
+            json.dump({"spans": self.spans}, f, indent=2)
+        logger.info(f"Save the profile to {outfile}")
+
+    def write_chrome_trace(self, outfile):
+        # complete events of the Trace Event Format, open with chrome://tracing or Perfetto
+        events = [{"name": span["name"], "ph": "X", "pid": os.getpid(), "tid": 0,
+                   "ts": round(span["start"] * 1e6), "dur": round(span["wall"] * 1e6),
+                   "args": {"cpu_s": span["cpu"], "peak_mb": span["peak_mb"], "peak_rss_mb": span["peak_rss_mb"],
+                            **span["args"]}}
+                  for span in self.spans]
+        with open(outfile, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        logger.info(f"Save the Chrome trace to {outfile}")
+
+
+# initialing profiler
+profiler = Profiler()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Pyramid.py
+@Time: 2025/03/04 10:52
+@Function: Multi-resolution tile pyramid of the contact matrix for zooming
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy import sparse
+
+from .BinMTX import bin_matrix
+from .PlotMTX import plot_matrix
+from .logger import logger
+
+
+def coarsen(matrix):
+    # sum 2 x 2 bins into one
+    if sparse.issparse(matrix):
+        matrix = matrix.tocoo()
+        size = -(-matrix.shape[0] // 2)
+        return sparse.csr_matrix((matrix.data, (matrix.row // 2, matrix.col // 2)), shape=(size, size))
+    return bin_matrix(matrix, -(-matrix.shape[0] // 2), reducer="sum")[0]
+
+
+def _get_block(matrix, row_start, row_end, col_start, col_end):
+    block = matrix[row_start:row_end, col_start:col_end]
+    return block.toarray() if sparse.issparse(block) else np.asarray(block, dtype=np.float32)
+
+
+def _dense_chunks(matrix, chunk_size):
+    # (i, j, block) of every upper triangle chunk
+    n_chunks = -(-matrix.shape[0] // chunk_size)
+    for i in range(n_chunks):
+        for j in range(i, n_chunks):
+            yield i, j, _get_block(matrix, i * chunk_size, (i + 1) * chunk_size, j * chunk_size, (j + 1) * chunk_size)
+
+
+def _sparse_chunks(matrix, chunk_size):
+    # (i, j, block) of the upper triangle chunks holding records; the records are bucketed by chunk in one sort,
+    # slicing the sparse matrix per chunk would scan the records once for every chunk
+    matrix = matrix.tocoo()
+    n_bins = matrix.shape[0]
+    n_chunks = -(-n_bins // chunk_size)
+    row_chunk, col_chunk = matrix.row // chunk_size, matrix.col // chunk_size
+    upper = row_chunk <= col_chunk
+    key = row_chunk[upper].astype(np.int64) * n_chunks + col_chunk[upper]
+    order = np.argsort(key, kind="stable")
+    key, row, col, data = key[order], matrix.row[upper][order], matrix.col[upper][order], matrix.data[upper][order]
+
+    edges = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1, [len(key)]))
+    for start, end in zip(edges[:-1], edges[1:]):
+        if start == end:
+            continue
+        i, j = divmod(int(key[start]), n_chunks)
+        height = min(chunk_size, n_bins - i * chunk_size)
+        width = min(chunk_size, n_bins - j * chunk_size)
+        index = (row[start:end] - i * chunk_size).astype(np.int64) * width + (col[start:end] - j * chunk_size)
+        block = np.bincount(index, weights=data[start:end], minlength=height * width)  # duplicates are summed
+        yield i, j, block.reshape(height, width).astype(np.float32)
+
+
+def export_pyramid(matrix, out_dir, resolution, labels=None, chunk_size=512):
+    # level 0 is the input matrix, every next level halves the bins until one chunk holds the whole matrix
+    logger.info(f"Export the multi-resolution pyramid to {out_dir}")
+    if hasattr(matrix, "blocks"):  # a lazily reordered matrix is materialized once
+        matrix = matrix.toarray()
+
+    levels = []
+    level = 0
+    while True:
+        n_bins = matrix.shape[0]
+        level_dir = os.path.join(out_dir, str(level))
+        shutil.rmtree(level_dir, ignore_errors=True)  # drop chunks of a previous export
+        os.makedirs(level_dir)
+
+        # the matrix is symmetric, only the upper triangle chunks are stored, empty chunks are skipped
+        chunks = _sparse_chunks(matrix, chunk_size) if sparse.issparse(matrix) else _dense_chunks(matrix, chunk_size)
+        for i, j, block in chunks:
+            if block.any():
+                np.savez_compressed(os.path.join(level_dir, f"{i}.{j}.npz"), data=block)
+
+        levels.append({"level": level, "resolution": resolution * 2 ** level, "n_bins": n_bins})
+        logger.info(f"Level {level}: {n_bins} bins at resolution {resolution * 2 ** level}")
+        if n_bins <= chunk_size:
+            break
+        matrix = coarsen(matrix)
+        level += 1
+
+    with open(os.path.join(out_dir, "pyramid.json"), 'w') as f:
+        json.dump({"resolution": resolution, "chunk_size": chunk_size, "levels": levels, "labels": labels}, f)
+
+
+def read_pyramid(pyramid_dir, level, start_bin, end_bin):
+    # dense [start_bin, end_bin) square of one level, assembled from its chunks
+    with open(os.path.join(pyramid_dir, "pyramid.json"), 'r') as f:
+        chunk_size = json.load(f)["chunk_size"]
+
+    out = np.zeros((end_bin - start_bin, end_bin - start_bin), dtype=np.float32)
+    first_chunk = start_bin // chunk_size
+    last_chunk = (end_bin - 1) // chunk_size
+    for i in range(first_chunk, last_chunk + 1):
+        for j in range(first_chunk, last_chunk + 1):
+            chunk_file = os.path.join(pyramid_dir, str(level), f"{min(i, j)}.{max(i, j)}.npz")
+            if not os.path.exists(chunk_file):
+                continue
+            with np.load(chunk_file) as chunk:
+                block = chunk["data"] if i <= j else chunk["data"].T
+
+            # overlap of the chunk and the region
+            row_start = max(start_bin, i * chunk_size)
+            row_end = min(end_bin, i * chunk_size + block.shape[0])
+            col_start = max(start_bin, j * chunk_size)
+            col_end = min(end_bin, j * chunk_size + block.shape[1])
+            block = block[row_start - i * chunk_size:row_end - i * chunk_size,
+                          col_start - j * chunk_size:col_end - j * chunk_size]
+            out[row_start - start_bin:row_end - start_bin, col_start - start_bin:col_end - start_bin] = block
+
+    return out
+
+
+def plot_region(pyramid_dir, start, end, outfile="Region.pdf", fig_size=6, dpi=300, max_pixels=None, **kwargs):
+    # start and end are bp positions along the matrix of the pyramid
+    with open(os.path.join(pyramid_dir, "pyramid.json"), 'r') as f:
+        meta = json.load(f)
+
+    if max_pixels is None:
+        max_pixels = fig_size * dpi
+
+    # the coarsest level that still has at least one bin per pixel
+    chosen = meta["levels"][0]
+    for level in reversed(meta["levels"]):
+        if (end - start) / level["resolution"] >= max_pixels:
+            chosen = level
+            break
+
+    level_resolution = chosen["resolution"]
+    start_bin = start // level_resolution
+    end_bin = min(chosen["n_bins"], max(start_bin + 1, -(-end // level_resolution)))
+    logger.info(f"Plot region {start}-{end} from level {chosen['level']} (resolution {level_resolution}), "
+                f"bins {start_bin}-{end_bin}")
+    matrix = read_pyramid(pyramid_dir, chosen["level"], start_bin, end_bin)
+
+    # chromosome ends falling into the region
+    chr_info = {}
+    for name, loci in (meta["labels"] or {}).items():
+        loci_bin = loci * meta["resolution"] / level_resolution - start_bin
+        if 0 <= loci_bin <= end_bin - start_bin:
+            chr_info[name] = loci_bin
+
+    plot_matrix(matrix, chr_info=chr_info, outfile=outfile, fig_size=(fig_size, fig_size), dpi=dpi,
+                max_pixels=max_pixels, **kwargs)
+    logger.info(f"Save the plot to {outfile}")
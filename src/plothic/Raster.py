@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Raster.py
+@Time: 2025/04/02 10:36
+@Function: Color the heatmap to an RGBA image and write raster figures with a fast encoder
+"""
+import numpy as np
+from PIL import Image
+from matplotlib.artist import Artist, allow_rasterization
+
+# formats written from the Agg pixel buffer by PIL, the others (pdf, svg, eps, ps) are vector formats
+RASTER_FORMATS = {
+    "png": {"format": "PNG", "compress_level": 1},
+    "tif": {"format": "TIFF", "compression": "tiff_lzw"},
+    "tiff": {"format": "TIFF", "compression": "tiff_lzw"},
+    "jpg": {"format": "JPEG", "quality": 95},
+    "jpeg": {"format": "JPEG", "quality": 95},
+}
+
+
+def output_format(outfile):
+    return outfile.rsplit(".", 1)[-1].lower() if "." in outfile else "png"
+
+
+def colormap_table(cmap):
+    # (N + 1, 4) uint8 colors of the color map, the last entry is the color of NaN values
+    table = cmap(np.concatenate((np.linspace(0, 1, cmap.N), [np.nan])), bytes=True)
+    return np.ascontiguousarray(table, dtype=np.uint8)
+
+
+def colorize(matrix, cmap, vmin, vmax, chunk_rows=512):
+    # RGBA image of the matrix by one lookup per value, with the binning of matplotlib (N equal bins from vmin to
+    # vmax, values outside are clipped to the first and last color); row chunks keep the temporaries small
+    table = colormap_table(cmap)
+    n_colors = len(table) - 1
+    scale = n_colors / (vmax - vmin) if vmax > vmin else None  # an empty range maps all values to the first color
+    rgba = np.empty(matrix.shape + (4,), dtype=np.uint8)
+    for row_start in range(0, matrix.shape[0], chunk_rows):
+        values = np.asarray(matrix[row_start:row_start + chunk_rows], dtype=np.float32)
+        if scale is None:
+            index = np.zeros(values.shape, dtype=np.float32)
+        else:
+            index = np.subtract(values, vmin, dtype=np.float32)
+            np.multiply(index, scale, out=index)
+            np.clip(index, 0, n_colors - 1, out=index)
+        index[np.isnan(values)] = n_colors
+        np.take(table, index.astype(np.intp), axis=0, out=rgba[row_start:row_start + chunk_rows])
+    return rgba
+
+
+class PixelImage(Artist):
+    # RGBA image (origin lower) over the data extent (left, right, bottom, top) of its axes, resampled to the device
+    # pixels of a raster renderer by nearest-neighbour indexing, without the image pipeline of imshow
+    zorder = 0
+
+    def __init__(self, rgba, extent):
+        super().__init__()
+        self.rgba = rgba
+        self.extent = extent
+
+    @allow_rasterization
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+        left, right, bottom, top = self.extent
+        (x0, y0), (x1, y1) = self.axes.transData.transform([(left, bottom), (right, top)])
+        clip = self.axes.bbox
+        col_start, col_end = int(round(max(x0, clip.x0))), int(round(min(x1, clip.x1)))
+        row_start, row_end = int(round(max(y0, clip.y0))), int(round(min(y1, clip.y1)))
+        if col_end <= col_start or row_end <= row_start:
+            return
+
+        # image row and column under the center of every device pixel, both rows go up from the bottom
+        n_rows, n_cols = self.rgba.shape[:2]
+        cols = ((np.arange(col_start, col_end) + 0.5 - x0) * (n_cols / (x1 - x0))).astype(np.intp)
+        rows = ((np.arange(row_start, row_end) + 0.5 - y0) * (n_rows / (y1 - y0))).astype(np.intp)
+        np.clip(cols, 0, n_cols - 1, out=cols)
+        np.clip(rows, 0, n_rows - 1, out=rows)
+        image = np.take(np.take(self.rgba, rows, axis=0), cols, axis=1)
+
+        gc = renderer.new_gc()
+        gc.set_clip_rectangle(clip)
+        renderer.draw_image(gc, col_start, row_start, image)
+        gc.restore()
+        self.stale = False
+
+
+def draw_heatmap(ax, rgba, extents, out_format):
+    # the colored heatmap over [0.5, extents] of both axes: drawn pixel for pixel for raster formats, embedded as
+    # one image that the renderer scales for vector formats
+    if out_format in RASTER_FORMATS:
+        ax.add_artist(PixelImage(rgba, (0.5, extents, 0.5, extents)))
+    else:
+        ax.imshow(rgba, origin="lower", interpolation="none", extent=(0.5, extents, 0.5, extents), aspect='auto')
+
+
+def save_canvas(fig, outfile, dpi):
+    # write the drawn figure from the Agg pixel buffer, False when the figure is not on an Agg canvas
+    if not hasattr(fig.canvas, "buffer_rgba"):
+        return False
+    fig.canvas.draw()
+    pixels = np.asarray(fig.canvas.buffer_rgba())[..., :3]  # the figure background is opaque
+    Image.fromarray(pixels).save(outfile, dpi=(dpi, dpi), **RASTER_FORMATS[output_format(outfile)])
+    return True
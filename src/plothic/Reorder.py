@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Reorder.py
+@Time: 2025/02/18 15:27
+@Function: Reorder the contact matrix by chromosome blocks
+"""
+import numpy as np
+from scipy import sparse
+
+
+def block_permutation(bounds, order):
+    # old bin index of every new bin, bounds: (start, end) bins of each block, order: block indices in new order
+    starts = np.array([bounds[k][0] for k in order], dtype=np.int64)
+    lengths = np.array([bounds[k][1] - bounds[k][0] for k in order], dtype=np.int64)
+    new_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.repeat(starts - new_starts, lengths) + np.arange(lengths.sum())
+
+
+class BlockReorder:
+    # lazy reordered view of a dense matrix, blocks are only copied when binned or materialized
+
+    def __init__(self, matrix, bounds, order):
+        self.matrix = matrix
+        self.bounds = [bounds[k] for k in order]
+        lengths = [end - start for start, end in self.bounds]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(int).tolist()
+        self.shape = (self.offsets[-1], self.offsets[-1])
+        self.dtype = matrix.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def blocks(self):
+        # (block, row offset, column offset) in the reordered matrix, blocks are views of the source
+        for i, (row_start, row_end) in enumerate(self.bounds):
+            for j, (col_start, col_end) in enumerate(self.bounds):
+                yield self.matrix[row_start:row_end, col_start:col_end], self.offsets[i], self.offsets[j]
+
+    def toarray(self, out=None):
+        if out is None:
+            out = np.empty(self.shape, dtype=self.dtype)
+        for block, row_offset, col_offset in self.blocks():
+            out[row_offset:row_offset + block.shape[0], col_offset:col_offset + block.shape[1]] = block
+        return out
+
+
+def reorder_matrix(matrix, bounds, order):
+    if not sparse.issparse(matrix):
+        # contiguous block copies into one output buffer
+        return BlockReorder(matrix, bounds, order).toarray()
+
+    # sparse: renumber the bins, records of blocks left out of the order are dropped
+    permutation = block_permutation(bounds, order)
+    new_index = np.full(matrix.shape[0], -1, dtype=np.int64)
+    new_index[permutation] = np.arange(len(permutation))
+
+    matrix = matrix.tocoo()
+    row = new_index[matrix.row]
+    col = new_index[matrix.col]
+    keep = (row >= 0) & (col >= 0)
+    return sparse.csr_matrix((matrix.data[keep], (row[keep], col[keep])),
+                             shape=(len(permutation), len(permutation)))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: Store.py
+@Time: 2025/03/28 15:02
+@Function: Compact binary store of HiCPro data, converted once and memory-mapped by every plot
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy import sparse
+
+from .ParseBed import load_hicpro, parse_abs_bed, read_triplets
+from .Profile import profiler
+from .logger import logger
+
+# a store directory holds:
+#   bins.npy    int32 (2, n_records), row and column bin (0-based) of the upper triangle records, sorted by row, column
+#   counts.npy  float32 (n_records,)
+#   indptr.npy  int64 (n_bins + 1,), the records of row i are indptr[i]:indptr[i + 1]
+#   chroms.json number of bins and records, chromosome bin ranges (the abs.bed information), written last
+STORE_VERSION = 1
+TEMP_COLUMNS = (("row", np.int32), ("col", np.int32), ("count", np.float32))
+
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "chroms.json"))
+
+
+def read_store_meta(store_dir):
+    with open(os.path.join(store_dir, "chroms.json"), 'r') as f:
+        meta = json.load(f)
+    if meta.get("version") != STORE_VERSION:
+        raise ValueError(f"Unsupported store version {meta.get('version')} in {store_dir}, please convert again")
+    return meta
+
+
+def convert_hicpro(matrix_file, abs_bed, store_dir, chunk_size=5000000):
+    # HiCPro matrix (plain or gzip) and abs.bed to a store, in chunks of chunk_size records
+    logger.info(f"Convert {matrix_file} and {abs_bed} to {store_dir}")
+    chr_info = parse_abs_bed(abs_bed)
+    n_bins = max(chr_info[i]["index"] for i in chr_info)
+    os.makedirs(store_dir, exist_ok=True)
+    meta_file = os.path.join(store_dir, "chroms.json")
+    if os.path.exists(meta_file):
+        os.remove(meta_file)  # the store is incomplete until the conversion finishes
+
+    # first pass: append the records to raw temporary columns, records are flipped to the upper triangle
+    temp_files = {name: os.path.join(store_dir, f"{name}.tmp") for name, _ in TEMP_COLUMNS}
+    n_records = 0
+    is_sorted = True
+    last_key = -1
+    handles = {name: open(temp_files[name], 'wb') for name, _ in TEMP_COLUMNS}
+    try:
+        for row, col, count in read_triplets(matrix_file, chunk_size=chunk_size):
+            row, col = np.minimum(row, col), np.maximum(row, col)
+            if len(row) == 0:
+                continue
+            if int(col.max()) >= n_bins:
+                logger.warning(f"Bin {int(col.max()) + 1} is beyond the abs bed file, enlarge the matrix")
+                n_bins = int(col.max()) + 1
+            key = row.astype(np.int64) * (1 << 32) + col
+            if is_sorted:
+                is_sorted = bool(key[0] >= last_key and np.all(key[1:] >= key[:-1]))
+            last_key = int(key[-1])
+            for name, values in (("row", row), ("col", col), ("count", count)):
+                values.tofile(handles[name])
+            n_records += len(row)
+            logger.info(f"Read {n_records} contact records")
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    # second pass: the final arrays, sorted by row and column when the input was not
+    temp = {name: np.memmap(temp_files[name], dtype=dtype, mode='r', shape=(n_records,)) if n_records else
+            np.empty(0, dtype=dtype) for name, dtype in TEMP_COLUMNS}
+    order = None
+    if not is_sorted:
+        logger.warning("The matrix records are not sorted by bin, sort them in memory")
+        order = np.lexsort((temp["col"], temp["row"]))
+
+    bins = open_memmap(os.path.join(store_dir, "bins.npy"), mode='w+', dtype=np.int32, shape=(2, n_records))
+    counts = open_memmap(os.path.join(store_dir, "counts.npy"), mode='w+', dtype=np.float32, shape=(n_records,))
+    row_count = np.zeros(n_bins, dtype=np.int64)
+    for start in range(0, n_records, chunk_size):
+        index = slice(start, start + chunk_size) if order is None else order[start:start + chunk_size]
+        row = temp["row"][index]
+        bins[0, start:start + chunk_size] = row
+        bins[1, start:start + chunk_size] = temp["col"][index]
+        counts[start:start + chunk_size] = temp["count"][index]
+        row_count += np.bincount(row, minlength=n_bins)
+    bins.flush()
+    counts.flush()
+    del bins, counts, temp, order
+    for temp_file in temp_files.values():
+        os.remove(temp_file)
+
+    np.save(os.path.join(store_dir, "indptr.npy"), np.concatenate(([0], np.cumsum(row_count))))
+    with open(meta_file, 'w') as f:
+        json.dump({"version": STORE_VERSION, "n_bins": n_bins, "n_records": n_records,
+                   "source": {"matrix": os.path.abspath(matrix_file), "abs_bed": os.path.abspath(abs_bed)},
+                   "chromosomes": chr_info}, f, indent=2)
+    logger.info(f"Saved {n_records} records of {n_bins} bins to {store_dir}")
+
+
+def load_store(store_dir):
+    # symmetric CSR matrix and chromosome information, the upper triangle is memory-mapped from the store
+    meta = read_store_meta(store_dir)
+    n_bins = meta["n_bins"]
+    bins = np.load(os.path.join(store_dir, "bins.npy"), mmap_mode='r')
+    counts = np.load(os.path.join(store_dir, "counts.npy"), mmap_mode='r')
+    indptr = np.load(os.path.join(store_dir, "indptr.npy"), mmap_mode='r')
+    logger.info(f"Read {meta['n_records']} contact records, {n_bins} bins from the store {store_dir}")
+
+    upper = sparse.csr_matrix((counts, bins[1], indptr), shape=(n_bins, n_bins))
+    return _mirror(upper), meta["chromosomes"]
+
+
+def _mirror(upper):
+    # symmetric matrix of the upper triangle records, the diagonal is counted once
+    return (upper + upper.T - sparse.diags(upper.diagonal())).tocsr()
+
+
+def load_store_chrom(store_dir, chrom, meta=None):
+    # intra-chromosome matrix of one chromosome, only the rows of the chromosome are read through the row index
+    meta = read_store_meta(store_dir) if meta is None else meta
+    start, end = meta["chromosomes"][chrom]["start"], meta["chromosomes"][chrom]["index"]
+    indptr = np.load(os.path.join(store_dir, "indptr.npy"), mmap_mode='r')
+    first, last = int(indptr[start]), int(indptr[end])
+
+    bins = np.load(os.path.join(store_dir, "bins.npy"), mmap_mode='r')
+    counts = np.load(os.path.join(store_dir, "counts.npy"), mmap_mode='r')
+    row, col = bins[0, first:last], bins[1, first:last]
+    intra = col < end  # the upper triangle rows of the chromosome also hold its records with later chromosomes
+    upper = sparse.csr_matrix((counts[first:last][intra], (row[intra] - start, col[intra] - start)),
+                              shape=(end - start, end - start))
+    return _mirror(upper)
+
+
+def load_contacts(matrix_file, abs_bed=None, cache=None):
+    # a store directory, or HiCPro text files which need the abs bed file
+    if is_store(matrix_file):
+        if abs_bed:
+            logger.info("The store holds the chromosome information, the abs bed file is not used")
+        return load_store(matrix_file)
+    if not abs_bed:
+        raise ValueError(f"{matrix_file} is not a store directory, please set the HiCPro abs bed file")
+    return load_hicpro(matrix_file, abs_bed, cache=cache)
+
+
+def iter_chrom_contacts(matrix_file, abs_bed=None, cache=None):
+    # (chromosome name, chromosome information, intra-chromosome matrix) of every chromosome; a store is read
+    # chromosome by chromosome, HiCPro text files are read once keeping only the intra-chromosome records
+    if is_store(matrix_file):
+        meta = read_store_meta(matrix_file)
+        for chrom, info in meta["chromosomes"].items():
+            with profiler.span("load", chrom=chrom):
+                matrix = load_store_chrom(matrix_file, chrom, meta=meta)
+            yield chrom, info, matrix
+        return
+
+    if not abs_bed:
+        raise ValueError(f"{matrix_file} is not a store directory, please set the HiCPro abs bed file")
+    with profiler.span("load"):
+        matrix, chr_info = load_hicpro(matrix_file, abs_bed, cache=cache, intra_only=True)
+    for chrom, info in chr_info.items():
+        yield chrom, info, matrix[info["start"]:info["index"], info["start"]:info["index"]]
+
+
+def convert_main(argv=None):
+    parser = argparse.ArgumentParser(prog="plothic convert",
+                                     description='Convert HiCPro data to a binary store for fast plotting')
+    parser.add_argument('matrix', type=str, help='HiCPro matrix file, plain or gzip compressed (.gz)')
+    parser.add_argument('abs_bed', type=str, help='HiCPro abs bed file, plain or gzip compressed (.gz)')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='Store directory, plot it with -matrix <directory> (no --abs-bed needed)')
+    parser.add_argument('--chunk-size', type=int, default=5000000,
+                        help='Number of records read at a time, default: 5000000')
+    args = parser.parse_args(argv)
+
+    convert_hicpro(args.matrix, args.abs_bed, args.output, chunk_size=args.chunk_size)
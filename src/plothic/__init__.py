@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+@Author: Zijie Jiang
+@Contact: jzjlab@163.com
+@File: __init__.py
+@Time: 2025/04/08 16:02
+@Function: Python API of PlotHiC
+"""
+
+# public name: module, imported on first use so "import plothic.cli" stays free of NumPy and matplotlib
+_API = {
+    "ContactMatrix": "Matrix",
+    "plot_matrix": "PlotMTX",
+    "plot_hic": "PlotHiC",
+    "plot_hic_split": "PlotHiC",
+    "plot_bed": "PlotBed",
+    "plot_bed_split": "PlotBed",
+}
+
+__all__ = list(_API)
+
+
+def __getattr__(name):
+    if name not in _API:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+
+    return getattr(import_module(f".{_API[name]}", __name__), name)
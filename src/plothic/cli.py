@@ -9,20 +9,31 @@
 @Function: Main function of PlotHiC
 """
 import argparse
+import os
+import sys
 
-from .PlotBed import plot_bed, plot_bed_split
-from .PlotHiC import plot_hic, plot_hic_split
+# the plotting modules (matplotlib, hicstraw, NumPy, SciPy) are imported on the code path that needs them,
+# so -h, -v, argument errors and batch bookkeeping start quickly
+from .Profile import profiler
 from .logger import logger
 
 __version__ = "1.0.0"
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Plot Whole genome Hi-C contact matrix heatmap')
+def build_parser():
+    parser = argparse.ArgumentParser(description='Plot Whole genome Hi-C contact matrix heatmap',
+                                     epilog='Run "plothic batch -h" to plot many inputs from a manifest file, '
+                                            '"plothic convert -h" to convert HiCPro data to a binary store, '
+                                            '"plothic compare -h" to compare samples side by side')
     parser.add_argument('-hic', '--hic-file', type=str, default=None, help='Path to the Hi-C file')
     parser.add_argument('-chr', '--chr-txt', type=str, default=None, help='Path to the chromosome text file')
+    parser.add_argument('-asy', '--assembly', type=str, default=None,
+                        help='Path to the .assembly file of the hic file, used instead of the chromosome text file')
+    parser.add_argument('--asy-chr-num', type=int, default=None,
+                        help='Number of chromosomes at the top of the assembly file to show, default: all')
 
-    parser.add_argument('-matrix', type=str, default=None, help='Path to the HiCPro matrix file')
+    parser.add_argument('-matrix', type=str, default=None,
+                        help='Path to the HiCPro matrix file or to a store directory made by "plothic convert"')
     parser.add_argument('--abs-bed', type=str, default=None, help='Path to the HiCPro abs bed file')
 
     parser.add_argument('-o', '--output', type=str, default='./', help='Output directory, default: ./')
@@ -32,15 +43,29 @@ def main():
     parser.add_argument('--abs-order', type=str, default="", help='Path to the HiCPro abs order file')
 
     parser.add_argument('--hic-split', type=str, default="", help='Plot the heatmap by split chromosome (hic format)')
+    parser.add_argument('--summary', action='store_true',
+                        help='Only summarize the contacts between chromosomes (hic format), as a TSV and a heatmap')
+    parser.add_argument('--summary-bin', type=int, default=0,
+                        help='Summarize bins of this size (bp) within every chromosome, default: 0 (whole chromosomes)')
 
     parser.add_argument('--bed-split', action='store_true', help='Plot the heatmap by split chromosome (HiCPro format)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes to render the split chromosome figures, default: 1')
 
     parser.add_argument('-g', '--genome-name', type=str, default="", help='Genome name for the heatmap')
     parser.add_argument('-r', '--resolution', type=int, default=None, help='Resolution for Hi-C data')
+    parser.add_argument('--tile-size', type=int, default=1400,
+                        help='Number of bins per tile when extracting .hic data, default: 1400')
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help='Number of worker processes to fetch .hic tiles, default: 1')
     parser.add_argument('-d', '--data-type', type=str, default='observed',
                         help='Data type for Hi-C data or "oe" (observed/expected), default: observed')
     parser.add_argument('-n', '--normalization', type=str, default='NONE',
                         help='Normalization method for Hi-C data (NONE, VC, VC_SQRT, KR, SCALE, etc.), default: NONE')
+    parser.add_argument('--balance', type=str.upper, default=None, choices=['ICE', 'VC', 'VC_SQRT'],
+                        help='Balance the extracted matrix (works for HiCPro data and .hic files without norms)')
+    parser.add_argument('--oe', action='store_true',
+                        help='Divide the extracted matrix by its distance-decay expected (observed/expected)')
     parser.add_argument('-log', action='store_true', help='Log2 transform the data')
 
     parser.add_argument('-cmap', type=str, default='YlOrRd', help='Color map for the heatmap, default: YlOrRd')
@@ -52,42 +77,165 @@ def main():
     parser.add_argument('-rotation', type=int, default=45, help='Rotation for the x and y axis labels, default: 45')
     parser.add_argument('-grid', action='store_false', help='Show grid in the heatmap, Default: True')
     parser.add_argument('--x-axis', action='store_true', help='Show genome size at x-axis, Default: False')
+    parser.add_argument('--reducer', type=str, default='mean', choices=['sum', 'mean', 'max'],
+                        help='How to merge matrix bins into one figure pixel, default: mean')
+    parser.add_argument('--vector-dpi', type=int, default=150,
+                        help='DPI of the heatmap image embedded in vector figures (pdf, svg), 0: one pixel per bin '
+                             'of the figure matrix, default: 150')
+
+    parser.add_argument('--pyramid', type=str, default=None,
+                        help='Directory of the multi-resolution pyramid, exported while plotting or read by --region')
+    parser.add_argument('--region', type=str, default=None,
+                        help='Plot the region START-END (bp along the heatmap) from the pyramid given by --pyramid')
+
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='Memory budget in GB to plan the resolution when -r is not set (hic format), '
+                             'default: the available memory')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Print the matrix size, tiles and memory of every resolution and exit without extracting')
+
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Cache the extracted matrix in this directory, re-plots skip the extraction')
+    parser.add_argument('--cache-size', type=float, default=20,
+                        help='Maximum size of the cache directory in GB, default: 20')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Persist the extracted .hic tiles in this directory, a stopped run started again '
+                             'fetches only the missing tiles')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='Log the wall-clock time, CPU time and peak memory of every stage at the end')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Also trace the peak Python allocations of every stage (tracemalloc); this slows the '
+                             'whole run down several times, the times of the profile included')
+    parser.add_argument('--profile-json', type=str, default=None, help='Write the profile spans to this JSON file')
+    parser.add_argument('--profile-trace', type=str, default=None,
+                        help='Write the profile as a Chrome trace (chrome://tracing, Perfetto) to this file')
 
     parser.add_argument('-v', '--version', action='version', version=__version__)
 
-    args = parser.parse_args()
+    return parser
+
+
+def run(args):
+    if not (args.profile or args.profile_memory or args.profile_json or args.profile_trace):
+        plot(args)
+        return
+
+    profiler.enable(trace_memory=args.profile_memory)
+    try:
+        with profiler.span("plothic"):
+            plot(args)
+    finally:
+        profiler.disable()
+        profiler.summary()
+        if args.profile_json:
+            profiler.write_json(args.profile_json)
+        if args.profile_trace:
+            profiler.write_chrome_trace(args.profile_trace)
+
+
+def check_plan_options(args, mode):
+    # the resolution plan (--dry-run, --max-memory) is made for the whole genome heatmap only
+    if args.dry_run or args.max_memory:
+        logger.error(f"--dry-run and --max-memory plan the whole genome heatmap, they can not be used with {mode}")
+        exit(1)
+
+
+def plot(args):
+    if args.region:
+        from .Pyramid import plot_region
+
+        if args.pyramid is None:
+            logger.error("Please set the pyramid directory (--pyramid) to plot a region")
+            exit(1)
+        start, end = (int(loci) for loci in args.region.split("-"))
+        output = os.path.join(args.output, f"Region.{args.format}") if os.path.isdir(args.output) else args.output
+        plot_region(args.pyramid, start, end, outfile=output, genome_name=args.genome_name, fig_size=args.fig_size,
+                    dpi=args.dpi, bar_min=args.bar_min, bar_max=args.bar_max, cmap=args.cmap, log=args.log,
+                    rotation=args.rotation, reducer=args.reducer, vector_dpi=args.vector_dpi)
+        return
 
     if args.matrix is None and args.hic_file is None:
         logger.error("Please check your input parameters")
         exit(1)
 
-    if args.matrix and args.abs_bed:
+    from .Cache import MatrixCache
+
+    cache = MatrixCache(args.cache_dir, max_size=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    max_memory = int(args.max_memory * 1024 ** 3) if args.max_memory else None
+
+    if args.matrix and (args.abs_bed or os.path.isdir(args.matrix)):  # a store needs no abs bed file
+        from .PlotBed import plot_bed, plot_bed_split
+
         if args.bed_split:
+            check_plan_options(args, "--bed-split")
             plot_bed_split(args.matrix, args.abs_bed, output=args.output, fig_size=args.fig_size, dpi=args.dpi,
                            bar_min=args.bar_min,
                            bar_max=args.bar_max, cmap=args.cmap, log=args.log, rotation=args.rotation,
-                           out_format=args.format, xaxis=args.x_axis)
+                           out_format=args.format, xaxis=args.x_axis, reducer=args.reducer, cache=cache,
+                           jobs=args.jobs, balance=args.balance, oe=args.oe, vector_dpi=args.vector_dpi)
         else:
             plot_bed(args.matrix, args.abs_bed, order_bed=args.abs_order, output=args.output,
                      genome_name=args.genome_name,
                      fig_size=args.fig_size, dpi=args.dpi, bar_min=args.bar_min, bar_max=args.bar_max, cmap=args.cmap,
-                     log=args.log, rotation=args.rotation, grid=args.grid, out_format=args.format, xaxis=args.x_axis)
+                     log=args.log, rotation=args.rotation, grid=args.grid, out_format=args.format, xaxis=args.x_axis,
+                     reducer=args.reducer, cache=cache, pyramid=args.pyramid, balance=args.balance, oe=args.oe,
+                     vector_dpi=args.vector_dpi, max_memory=max_memory, dry_run=args.dry_run)
     else:
-        if args.hic_split != "" and args.hic_file:
+        from .PlotHiC import plot_hic, plot_hic_split, plot_hic_summary
+
+        if args.summary and args.hic_file and (args.chr_txt or args.assembly):
+            check_plan_options(args, "--summary")
+            plot_hic_summary(args.hic_file, chr_txt=args.chr_txt, output=args.output, resolution=args.resolution,
+                             data_type=args.data_type, normalization=args.normalization, genome_name=args.genome_name,
+                             fig_size=args.fig_size, dpi=args.dpi, bar_min=args.bar_min, bar_max=args.bar_max,
+                             cmap=args.cmap, log=args.log, rotation=args.rotation, out_format=args.format,
+                             tile_size=args.tile_size, threads=args.threads, assembly=args.assembly,
+                             asy_chr_num=args.asy_chr_num, summary_bin=args.summary_bin, vector_dpi=args.vector_dpi)
+        elif args.hic_split != "" and args.hic_file:
+            check_plan_options(args, "--hic-split")
             plot_hic_split(args.hic_file, args.hic_split, output=args.output, resolution=args.resolution,
                            data_type=args.data_type,
                            normalization=args.normalization, genome_name=args.genome_name, fig_size=args.fig_size,
                            dpi=args.dpi,
                            bar_min=args.bar_min,
                            bar_max=args.bar_max, cmap=args.cmap, log=args.log, rotation=args.rotation,
-                           out_format=args.format, xaxis=args.x_axis)
-        elif args.hic_file:
+                           out_format=args.format, xaxis=args.x_axis, reducer=args.reducer,
+                           tile_size=args.tile_size, threads=args.threads, cache=cache, jobs=args.jobs,
+                           balance=args.balance, oe=args.oe, vector_dpi=args.vector_dpi)
+        elif args.hic_file and (args.chr_txt or args.assembly):
             plot_hic(args.hic_file, chr_txt=args.chr_txt, output=args.output, resolution=args.resolution,
                      data_type=args.data_type, normalization=args.normalization, genome_name=args.genome_name,
                      fig_size=args.fig_size, dpi=args.dpi, bar_min=args.bar_min, bar_max=args.bar_max, cmap=args.cmap,
-                     order=args.order, log=args.log, rotation=args.rotation, grid=args.grid, out_format=args.format, xaxis=args.x_axis)
+                     order=args.order, log=args.log, rotation=args.rotation, grid=args.grid, out_format=args.format,
+                     xaxis=args.x_axis, reducer=args.reducer, tile_size=args.tile_size, threads=args.threads,
+                     cache=cache, pyramid=args.pyramid, balance=args.balance, oe=args.oe, assembly=args.assembly,
+                     asy_chr_num=args.asy_chr_num, vector_dpi=args.vector_dpi, max_memory=max_memory,
+                     dry_run=args.dry_run, checkpoint=args.checkpoint)
         else:
             logger.error("Please check your input parameters")
+            exit(1)
+
+
+def main():
+    # figures are only written to files, the non-interactive backend also skips loading a GUI toolkit
+    os.environ["MPLBACKEND"] = "Agg"
+
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from .Batch import batch_main
+        batch_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "convert":
+        from .Store import convert_main
+        convert_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        from .Compare import compare_main
+        compare_main(sys.argv[2:])
+        return
+
+    args = build_parser().parse_args()
+    run(args)
 
 
 if __name__ == '__main__':